@@ -1,62 +1,420 @@
-import moviepy.editor as mp
 import numpy as np
 from scipy.io import wavfile
+from scipy import signal
+from concurrent.futures import ProcessPoolExecutor
+import subprocess
+import hashlib
+import json
+import time
+import sys
 import os
-from log import logger
+import tracing
+from log import logger, worker_queue, init_worker
 
-def extract_audio_from_video(mp4_file, output_audio_file="audio.wav"):
-    video = mp.VideoFileClip(mp4_file)
-    # Extract the audio
-    audio = video.audio
-    # Write the audio to a wav file
-    audio.write_audiofile(output_audio_file, codec='pcm_s16le')
-    return output_audio_file
+# What the batch mode picks up from the folders
+MEDIA_EXTENSIONS = (".mp4", ".mkv", ".webm", ".m4a", ".mp3", ".wav", ".flac")
 
-def calculate_dB_levels(audio_file):
-    # Load the audio file
-    sample_rate, audio_data = wavfile.read(audio_file)
-    # Ensure the audio is mono (one channel)
-    if len(audio_data.shape) > 1:
-        audio_data = audio_data.mean(axis=1)
-    
-    # Calculate the dB levels
-    def rms_to_db(rms):
-        return 20 * np.log10(rms) if rms > 0 else -np.inf
-
-    # Calculate the RMS value for audio data
-    rms_values = np.sqrt(np.mean(audio_data.astype(np.float32) ** 2))
-    peak_db = rms_to_db(np.max(np.abs(audio_data.astype(np.float32))))  # Highest peak
-    average_db = rms_to_db(rms_values)  # Average level
-    
-    # Filter out silent periods by setting a threshold
-    threshold = 1e-6
-    non_silent_audio = audio_data[np.abs(audio_data) > threshold]
+def rms_to_db(rms):
+    return 20 * np.log10(rms) if rms > 0 else -np.inf
+
+def k_weighting(sample_rate):
+    """
+    ITU-R BS.1770 K-weighting (high shelf + RLB high pass) as one 4th order filter for any sample rate.
+    Same bilinear transform parameters as libebur128.
+    """
+    # High shelf, models the acoustic effect of the head
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # RLB high pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass_b = [1, -2, 1]
+    highpass_a = [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.convolve(shelf_b, highpass_b), np.convolve(shelf_a, highpass_a)
+
+def power_to_lufs(power):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(power)
+
+class LoudnessMeter:
+    """
+    EBU R128 / ITU-R BS.1770 loudness, fed one chunk at a time (float samples -1..1, shape (n,) or (n, channels)).
+    The K-weighted signal is reduced to the mean power of every 100 ms, momentary (400 ms) and
+    short-term (3 s) loudness are moving averages over those, and the gating works on the whole block array at once.
+    True peak comes from 4x oversampling.
+    """
+    def __init__(self, sample_rate=44100):
+        self.sample_rate = sample_rate
+        self.step = sample_rate // 10  # 100 ms
+        self.b, self.a = k_weighting(sample_rate)
+        self.zi = None  # Filter state carried between chunks
+        self.carry = None  # K-weighted samples of an unfinished 100 ms step
+        self.steps = []  # Mean power of every 100 ms step, summed over channels
+        self.true_peak = 0.0
+        self.overlap = 16
+        self.history = None  # End of the previous chunk so the oversampling has no seams
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        if samples.shape[0] == 0:
+            return
+        if self.zi is None:
+            self.zi = np.zeros((len(self.a) - 1, samples.shape[1]))
+            self.carry = np.empty((0, samples.shape[1]))
+            self.history = np.zeros((2 * self.overlap, samples.shape[1]))
+
+        weighted, self.zi = signal.lfilter(self.b, self.a, samples, axis=0, zi=self.zi)
+        weighted = np.concatenate((self.carry, weighted))
+        whole = weighted.shape[0] // self.step * self.step
+        if whole:
+            blocks = weighted[:whole].reshape(-1, self.step, weighted.shape[1])
+            self.steps.extend(np.mean(blocks ** 2, axis=1).sum(axis=1).tolist())
+        self.carry = weighted[whole:]
+
+        # Both ends of the oversampled chunk ring, so only the middle is used and the
+        # last few samples get checked again with the next chunk
+        padded = np.concatenate((self.history, samples))
+        oversampled = signal.resample_poly(padded, 4, 1, axis=0)[self.overlap * 4:(len(padded) - self.overlap) * 4]
+        if oversampled.size:
+            self.true_peak = max(self.true_peak, float(np.abs(oversampled).max()))
+        self.history = padded[-2 * self.overlap:]
+
+    def blocks(self, length):
+        # Mean power of every window of length steps, one step (100 ms) apart
+        steps = np.asarray(self.steps)
+        if len(steps) < length:
+            return np.empty(0)
+        return np.convolve(steps, np.ones(length) / length, mode="valid")
+
+    def results(self):
+        momentary = self.blocks(4)
+        short_term = self.blocks(30)
+
+        # Integrated: absolute gate at -70 LUFS, then relative gate 10 LU under the mean of what's left
+        integrated = -np.inf
+        gated = momentary[power_to_lufs(momentary) > -70]
+        if gated.size:
+            relative_gate = power_to_lufs(gated.mean()) - 10
+            gated = gated[power_to_lufs(gated) > relative_gate]
+            integrated = power_to_lufs(gated.mean())
+
+        # Loudness range: spread between the 10th and 95th percentile of gated short-term loudness
+        loudness_range = 0.0
+        short_lufs = power_to_lufs(short_term)
+        short_lufs = short_lufs[short_lufs > -70]
+        if short_lufs.size:
+            relative_gate = power_to_lufs(short_term[power_to_lufs(short_term) > -70].mean()) - 20
+            short_lufs = short_lufs[short_lufs > relative_gate]
+            low, high = np.percentile(short_lufs, [10, 95])
+            loudness_range = high - low
+
+        return {
+            "integrated": float(integrated),
+            "range": float(loudness_range),
+            "momentary_max": float(power_to_lufs(momentary.max())) if momentary.size else -np.inf,
+            "short_term_max": float(power_to_lufs(short_term.max())) if short_term.size else -np.inf,
+            "true_peak": float(rms_to_db(self.true_peak)),
+        }
+
+class LevelAccumulator:
+    """
+    Builds the same min/peak/average dB values as calculate_dB_levels one chunk at a time,
+    so the recorder can feed it while capturing and the numbers are ready when it stops.
+    Float samples (-1..1) are scaled to int16 magnitude to match the values from a decoded file,
+    pass scale=1 for samples that already are int16.
+    With window_ms set it also keeps the short-term RMS of every window as (start seconds, dB) in windows.
+    The loudness attribute gets the same chunks for the EBU R128 values.
+    """
+    def __init__(self, scale=32768.0, threshold=1e-6, sample_rate=44100, window_ms=None):
+        self.scale = scale
+        self.threshold = threshold
+        self.sum_squares = 0.0
+        self.count = 0
+        self.peak = 0.0
+        self.quietest = np.inf
+        self.window = int(sample_rate * window_ms / 1000) if window_ms else None
+        self.sample_rate = sample_rate
+        self.windows = []
+        self.carry = np.empty(0, dtype=np.float32)  # Samples of a window that isn't complete yet
+        self.loudness = LoudnessMeter(sample_rate)
+
+    def update(self, samples):
+        # Every chunk goes through here while recording, so when tracing each one gets timed
+        tracer = tracing.active()
+        if tracer is None:
+            self.accumulate(samples)
+            return
+        start = time.perf_counter()
+        self.accumulate(samples)
+        tracer.observe("measure_audio.update", time.perf_counter() - start)
+
+    def accumulate(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        # Loudness wants every channel of the source as is and full scale floats
+        self.loudness.update(samples * (self.scale / 32768))
+        # The dB stats use the old stereo mean downmix (for mono that's the samples themselves)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        if samples.size == 0:
+            return
+        magnitude = np.abs(samples * self.scale)
+        self.sum_squares += float(np.square(magnitude, dtype=np.float64).sum())
+        self.count += magnitude.size
+        self.peak = max(self.peak, float(magnitude.max()))
+        # Quietest non-silent sample
+        non_silent = magnitude[magnitude > self.threshold]
+        if non_silent.size:
+            self.quietest = min(self.quietest, float(non_silent.min()))
+        if self.window:
+            self.update_windows(magnitude)
+
+    def update_windows(self, magnitude):
+        # Whole windows are computed in one go as rows of a 2D view, the rest waits for the next chunk
+        start = self.count - magnitude.size - self.carry.size
+        if self.carry.size:
+            magnitude = np.concatenate((self.carry, magnitude))
+        whole = magnitude.size // self.window * self.window
+        if whole:
+            blocks = magnitude[:whole].reshape(-1, self.window).astype(np.float64)
+            rms = np.sqrt(np.mean(blocks ** 2, axis=1))
+            times = (start + np.arange(len(rms)) * self.window) / self.sample_rate
+            self.windows.extend(zip(times.tolist(), (rms_to_db(value) for value in rms.tolist())))
+        self.carry = magnitude[whole:].copy()
+
+    def levels(self):
+        average = np.sqrt(self.sum_squares / self.count) if self.count else 0
+        min_db = rms_to_db(self.quietest) if np.isfinite(self.quietest) else -np.inf
+        return min_db, rms_to_db(self.peak), rms_to_db(average)
+
+def read_wav_chunks(audio_file, chunk_seconds=10):
+    """
+    Memory maps the WAV and hands it out in chunks, only the chunk being analyzed is ever loaded.
+    Returns the sample rate and a generator of chunks.
+    """
+    sample_rate, audio_data = wavfile.read(audio_file, mmap=True)
+    chunk_size = int(sample_rate * chunk_seconds)
 
-    if non_silent_audio.size == 0:
-        min_db = -np.inf  # If no non-silent audio, return -inf
-    else:
-        min_db = rms_to_db(np.min(np.abs(non_silent_audio.astype(np.float32))))  # Quietest non-silent part
+    def chunks():
+        for start in range(0, len(audio_data), chunk_size):
+            yield audio_data[start:start + chunk_size]
+    return sample_rate, chunks()
 
-    return min_db, peak_db, average_db
+def audio_channels(media_file):
+    """
+    Channel count of the first audio stream, None if ffprobe can't tell.
+    """
+    ffprobe_cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=channels",
+        "-of", "csv=p=0",
+        media_file
+    ]
+    try:
+        return int(subprocess.run(ffprobe_cmd, capture_output=True, text=True).stdout.strip())
+    except (OSError, ValueError):
+        return None
 
-def write_to_file(min_db, peak_db, average_db, output_file="audiovalues.txt"):
+def decode_chunks(media_file, sample_rate=44100, chunk_seconds=10):
+    """
+    Decodes any media file through an ffmpeg pipe into int16 chunks (samples x channels),
+    no temporary file and never more than one chunk in memory.
+    Mono stays mono: duplicating it into two channels would add 3 LU to the loudness.
+    """
+    channels = audio_channels(media_file)
+    if channels is None or channels > 2:
+        # Surround (or unknown) gets the old stereo downmix, the loudness meter has no surround weighting
+        channels = 2
+    ffmpeg_cmd = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-i", media_file,
+        "-vn",                                     # Skip the video stream
+        "-ac", str(channels),
+        "-ar", str(sample_rate),
+        "-f", "s16le",                             # Raw int16 samples
+        "-"
+    ]
+    frame_bytes = channels * 2
+    chunk_bytes = int(sample_rate * chunk_seconds) * frame_bytes
+    with subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            # Drop a trailing partial sample frame, only possible at the very end
+            usable = len(data) // frame_bytes * frame_bytes
+            yield np.frombuffer(data[:usable], dtype="<i2").reshape(-1, channels)
+
+def calculate_dB_levels(audio_file):
+    # Go through the file in chunks, the stats are built in a single pass with constant memory
+    sample_rate, chunks = read_wav_chunks(audio_file)
+    levels = LevelAccumulator(scale=1.0, sample_rate=sample_rate)
+    for chunk in chunks:
+        levels.update(chunk)
+    return levels.levels()
+
+def loudness_lines(loudness):
+    return [
+        f"Integrated Loudness: {loudness['integrated']:.2f} LUFS",
+        f"Loudness Range: {loudness['range']:.2f} LU",
+        f"Max Momentary Loudness: {loudness['momentary_max']:.2f} LUFS",
+        f"Max Short-term Loudness: {loudness['short_term_max']:.2f} LUFS",
+        f"True Peak: {loudness['true_peak']:.2f} dBTP",
+    ]
+
+def write_to_file(min_db, peak_db, average_db, loudness=None, output_file="audiovalues.txt"):
     with open(output_file, "w") as file:
         file.write(f"Lowest Volume (dB): {min_db:.2f} dB\n")
         file.write(f"Highest Peak (dB): {peak_db:.2f} dB\n")
         file.write(f"Average Volume (dB): {average_db:.2f} dB\n")
+        if loudness:
+            for line in loudness_lines(loudness):
+                file.write(line + "\n")
 
-def measure_audio(mp4_file):
-    audio_file = extract_audio_from_video(mp4_file)
-    min_db, peak_db, average_db = calculate_dB_levels(audio_file)
-    
+def report_levels(min_db, peak_db, average_db, loudness=None):
     # Write the values to the file
-    write_to_file(min_db, peak_db, average_db)
+    write_to_file(min_db, peak_db, average_db, loudness)
     
     # logger the values
     logger.info(f"Lowest Volume (dB): {min_db:.2f} dB")
     logger.info(f"Highest Peak (dB): {peak_db:.2f} dB")
     logger.info(f"Average Volume (dB): {average_db:.2f} dB")
-    
-    # Clean up the temporary audio file
-    if os.path.exists(audio_file):
-        os.remove(audio_file)
+    if loudness:
+        for line in loudness_lines(loudness):
+            logger.info(line)
+
+def analyze_media(media_file, window_ms=None):
+    levels = LevelAccumulator(scale=1.0, window_ms=window_ms)
+    for chunk in decode_chunks(media_file):
+        levels.update(chunk)
+    return levels
+
+@tracing.traced("measure_audio")
+def measure_audio(mp4_file, window_ms=None):
+    """
+    Measures the levels of any length file straight from an ffmpeg decode pipe.
+    With window_ms set, the returned accumulator also has the short-term RMS over time in .windows.
+    """
+    levels = analyze_media(mp4_file, window_ms)
+    report_levels(*levels.levels(), levels.loudness.results())
+    return levels
+
+def file_hash(path):
+    # Read in blocks so big recordings don't get loaded whole
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def measure_file(path, digest):
+    """
+    One row of the batch results. Runs in a worker process.
+    """
+    levels = analyze_media(path)
+    min_db, peak_db, average_db = levels.levels()
+    row = {"hash": digest, "min_db": min_db, "peak_db": peak_db, "average_db": average_db}
+    row.update(levels.loudness.results())
+    return row
+
+def json_safe(value):
+    """
+    Silence measures as -inf dB, which json.dumps writes as -Infinity and most JSON readers reject.
+    Non-finite floats become None (null), nested dicts/lists included.
+    """
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def load_cache(cache_file):
+    """
+    Reads the JSONL cache into {path: row}, later lines win.
+    """
+    cache = {}
+    if os.path.exists(cache_file):
+        with open(cache_file) as file:
+            for line in file:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut off by a crash, it just gets measured again
+                cache[row["file"]] = row
+    return cache
+
+def measure_directory(folders=("Recordings", "Downloads"), cache_file="audio_cache.jsonl",
+                      output_file="audiovalues.jsonl", workers=None):
+    """
+    Measures every media file in the folders on a process pool and writes one JSON row per file.
+    Results are cached by size, mtime and content hash, unchanged files never get decoded again
+    and a file that was only touched or renamed is recognized by its hash.
+    """
+    files = sorted(
+        os.path.abspath(os.path.join(folder, name))
+        for folder in folders if os.path.isdir(folder)
+        for name in os.listdir(folder)
+        if name.lower().endswith(MEDIA_EXTENSIONS)
+    )
+    cache = load_cache(cache_file)
+    by_hash = {row["hash"]: row for row in cache.values()}
+    rows = {}
+    stats = {path: os.stat(path) for path in files}
+
+    # Same size and mtime as last time, trust it without even hashing
+    changed = []
+    for path in files:
+        row = cache.get(path)
+        if row and row["size"] == stats[path].st_size and row["mtime"] == stats[path].st_mtime:
+            rows[path] = row
+        else:
+            changed.append(path)
+    logger.info(f"Batch measure: {len(files)} files, {len(rows)} unchanged, {len(changed)} to check.")
+
+    # The workers log through the main process, it's the only one writing the log file
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_queue(),)) as executor:
+        # Hash the rest, only content we've never seen gets decoded
+        to_measure = []
+        for path, digest in zip(changed, executor.map(file_hash, changed)):
+            if digest in by_hash:
+                rows[path] = dict(by_hash[digest])
+            else:
+                to_measure.append((path, digest))
+        logger.info(f"Batch measure: decoding {len(to_measure)} files.")
+
+        futures = {path: executor.submit(measure_file, path, digest) for path, digest in to_measure}
+        for path, future in futures.items():
+            try:
+                rows[path] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to measure {path}: {e}")
+
+    # Append what's new to the cache, then write the full result set
+    with open(cache_file, "a") as file:
+        for path in changed:
+            if path in rows:
+                rows[path].update(file=path, size=stats[path].st_size, mtime=stats[path].st_mtime)
+                file.write(json.dumps(json_safe(rows[path])) + "\n")
+    results = [rows[path] for path in files if path in rows]
+    with open(output_file, "w") as file:
+        for row in results:
+            # Rows read back from an older cache can still hold -inf
+            file.write(json.dumps(json_safe(row)) + "\n")
+    logger.info(f"Batch measure: wrote {len(results)} rows to {output_file}")
+    return results
+
+if __name__ == "__main__":
+    # python audio_measure.py [folder ...]
+    measure_directory(sys.argv[1:] or ("Recordings", "Downloads"))
@@ -0,0 +1,68 @@
+import time
+import itertools
+import contextlib
+import soundcard as sc
+import soundfile as sf
+from log import logger
+
+
+class LoopbackRecorder:
+    """
+    Records the default speaker's loopback and writes every chunk to disk as soon as it arrives.
+    Memory stays flat no matter how long the recording is, and the file is usable up to the
+    last chunk even if the process dies (FLAC frames decode on their own, so it's the default).
+    With output_file None nothing is written (listeners only), with record_sec None it runs until stopped.
+    """
+    # Not recommended to change these
+    # I spent a while finding the one that glitches the least with this library
+    def __init__(self, output_file:str, stop_event, record_sec:int, sample_rate:int=44100, chunk_duration:int=1) -> None:
+        self.output_file = output_file
+        self.stop_event = stop_event
+        self.record_sec = record_sec
+        self.sample_rate = sample_rate
+        self.chunk_duration = chunk_duration
+        self.samples_written = 0
+        # (index of the chunk's first sample, perf_counter time the chunk started)
+        self.chunk_times = []
+        # Called with every mono chunk as it arrives, e.g. to measure levels while recording
+        self.listeners = []
+
+    def run(self) -> None:
+        if self.output_file:
+            output = sf.SoundFile(self.output_file, mode="w", samplerate=self.sample_rate, channels=1)
+        else:
+            output = contextlib.nullcontext()
+        if self.record_sec is None:
+            chunks = itertools.count()
+        else:
+            chunks = range(int(self.record_sec // self.chunk_duration))
+        with output as file:
+            with sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(samplerate=self.sample_rate) as mic:
+                for _ in chunks:
+                    if self.stop_event.is_set():
+                        break
+                    chunk = mic.record(numframes=self.sample_rate * self.chunk_duration)
+                    # record() returns once the chunk is complete, so it started one chunk length ago
+                    started = time.perf_counter() - len(chunk) / self.sample_rate
+                    self.chunk_times.append((self.samples_written, started))
+                    samples = chunk[:, 0]
+                    if file is not None:
+                        file.write(samples)
+                        file.flush()
+                    self.samples_written += len(samples)
+                    for listener in self.listeners:
+                        try:
+                            listener(samples)
+                        except Exception as e:
+                            logger.error(f"Audio listener failed: {e}")
+                    if self.stop_event.is_set():
+                        break
+        logger.info(f"Audio saved: {self.samples_written / self.sample_rate:.2f}s in {len(self.chunk_times)} chunks.")
+
+    def offset_from(self, start:float) -> float:
+        """
+        Seconds between start (a perf_counter time, e.g. the first video frame) and the first audio sample.
+        """
+        if not self.chunk_times:
+            return 0.0
+        return self.chunk_times[0][1] - start
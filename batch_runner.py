@@ -0,0 +1,194 @@
+import re
+import sys
+import json
+import time
+import threading
+import urllib.request
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from log import logger
+from player import YouTubeAutomation
+from audio_measure import LevelAccumulator, json_safe
+
+
+def load_jobs(job_file:str) -> list:
+    """
+    One job per line, either JSON ({"keyword": ...} or {"url": ...}, optionally with "seconds")
+    or just a keyword/link as plain text. Blank lines and # comments are skipped.
+    """
+    jobs = []
+    with open(job_file, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                job = line
+            if isinstance(job, str):
+                job = {"url": job} if job.startswith(("http://", "https://")) else {"keyword": job}
+            jobs.append(job)
+    logger.info(f"Loaded {len(jobs)} jobs from {job_file}")
+    return jobs
+
+
+def find_video_ids(data) -> list:
+    """
+    Video ids of the organic results in YouTube's ytInitialData, in page order (ads use other renderers).
+    """
+    found = []
+    if isinstance(data, dict):
+        if "videoRenderer" in data and "videoId" in data["videoRenderer"]:
+            found.append(data["videoRenderer"]["videoId"])
+        for value in data.values():
+            found.extend(find_video_ids(value))
+    elif isinstance(data, list):
+        for value in data:
+            found.extend(find_video_ids(value))
+    return found
+
+
+def search_link(keyword:str) -> str:
+    """
+    Resolves a keyword without the browser by reading the results page's embedded data.
+    Returns None if YouTube didn't give us something we can parse, the browser search is the fallback.
+    """
+    request = urllib.request.Request(
+        "https://www.youtube.com/results?" + urlencode({"search_query": keyword}),
+        headers={"Accept-Language": "en-US,en;q=0.9", "Cookie": "CONSENT=YES+1", "User-Agent": "Mozilla/5.0"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            page = response.read().decode("utf-8", errors="replace")
+        match = re.search(r"var ytInitialData = (\{.*?\});</script>", page, re.DOTALL)
+        video_ids = find_video_ids(json.loads(match.group(1))) if match else []
+    except (OSError, ValueError) as e:
+        logger.warning(f"Background search for '{keyword}' failed: {e}")
+        return None
+    if not video_ids:
+        logger.warning(f"Background search for '{keyword}' found no results.")
+        return None
+    return f"https://www.youtube.com/watch?v={video_ids[0]}"
+
+
+class BatchRunner:
+    """
+    Runs a list of search/record jobs with the stages overlapped:
+    while one video records, the next job is searched and its page loads in a background tab,
+    and finished recordings are muxed and measured on a worker pool.
+    The recordings themselves run back to back, so the total is close to the sum of the recording times.
+    Extra keyword arguments go to YouTubeAutomation.
+    """
+    def __init__(self, job_file:str, record_time:int=10, workers:int=2, results_file:str="batch_results.jsonl", **automation_kwargs) -> None:
+        self.jobs = load_jobs(job_file)
+        self.record_time = record_time
+        self.workers = workers
+        self.results_file = results_file
+        self.automation_kwargs = automation_kwargs
+        self.results_lock = threading.Lock()
+        self.automation = None
+
+    def preload(self, job:dict) -> tuple:
+        """
+        Runs in the background: finds the job's link and opens it in a hidden tab. Returns (link, tab handle).
+        """
+        link = job.get("url")
+        if link is None:
+            cache = self.automation.search_cache
+            link = (cache.get(job["keyword"]) if cache else None) or search_link(job["keyword"])
+        if link is None:
+            return None, None
+        return link, self.automation.preload_tab(link)
+
+    def open(self, job:dict, link:str, handle:str) -> str:
+        """
+        Brings the job's video up in the foreground tab, returns the link that's playing.
+        """
+        if handle is not None:
+            self.automation.open_preloaded(handle)
+            if not self.automation.unavailable:
+                if "keyword" in job and self.automation.search_cache:
+                    self.automation.search_cache.put(job["keyword"], link)
+                return link
+        # Not preloaded, or the preloaded video is gone: do it the slow way
+        if "keyword" in job:
+            return self.automation.play_keyword(job["keyword"])
+        self.automation.start_video(job["url"])
+        return job["url"]
+
+    def save_result(self, result:dict) -> None:
+        with self.results_lock:
+            with open(self.results_file, "a", encoding="utf-8") as file:
+                file.write(json.dumps(json_safe(result)) + "\n")
+
+    def finished(self, result:dict, levels:LevelAccumulator, output_future) -> None:
+        # Called on the worker pool once a recording is encoded
+        error = output_future.exception()
+        if error is None:
+            min_db, peak_db, average_db = levels.levels()
+            result.update(output=output_future.result(), min_db=min_db, peak_db=peak_db,
+                          average_db=average_db, loudness=levels.loudness.results())
+        else:
+            result["error"] = str(error)
+            logger.error(f"Finishing {result['job']} failed: {error}")
+        self.save_result(result)
+
+    def failed(self, result:dict, error:Exception) -> None:
+        result["error"] = str(error)
+        logger.error(f"Job {result['job']} failed: {error}")
+        self.save_result(result)
+
+    def run(self) -> None:
+        if not self.jobs:
+            return
+        start_time = time.time()
+        recorded_time = 0
+        self.automation = YouTubeAutomation(**self.automation_kwargs)
+        self.automation.initialize_driver()
+        prefetcher = ThreadPoolExecutor(max_workers=1)
+        finishers = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            preload = prefetcher.submit(self.preload, self.jobs[0])
+            for index, job in enumerate(self.jobs):
+                result = {"job": job}
+                # One broken job (bad link, page that never loads) gets an error row, the rest of the batch still runs
+                try:
+                    link, handle = preload.result()
+                    result["link"] = self.open(job, link, handle)
+                except Exception as e:
+                    self.failed(result, e)
+                finally:
+                    # Playing now, so the next one can load in the background while this records
+                    if index + 1 < len(self.jobs):
+                        preload = prefetcher.submit(self.preload, self.jobs[index + 1])
+                if "error" in result:
+                    continue
+
+                seconds = job.get("seconds", self.record_time)
+                levels = LevelAccumulator()
+                try:
+                    output = self.automation.record(seconds, levels=levels, finish_executor=finishers)
+                except Exception as e:
+                    self.failed(result, e)
+                    continue
+                if output is None:
+                    result["error"] = "unavailable"
+                    self.save_result(result)
+                    continue
+                recorded_time += seconds
+                output.add_done_callback(lambda future, result=result, levels=levels: self.finished(result, levels, future))
+                logger.info(f"Job {index + 1}/{len(self.jobs)} recorded.")
+        finally:
+            prefetcher.shutdown(wait=True)
+            # Every recording has to be written out before the browser goes
+            finishers.shutdown(wait=True)
+            self.automation.clean_up()
+        total_time = time.time() - start_time
+        logger.info(f"Batch done: {len(self.jobs)} jobs in {total_time:.1f}s, {recorded_time}s of that recording. "
+                    f"Results in {self.results_file}")
+
+
+if __name__ == "__main__":
+    # python batch_runner.py jobs.jsonl [seconds]
+    BatchRunner(sys.argv[1], record_time=int(sys.argv[2]) if len(sys.argv) > 2 else 10).run()
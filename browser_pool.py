@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from log import logger
+from player import YouTubeAutomation
+from search_cache import SearchCache
+
+# Job names and the YouTubeAutomation method they run
+ACTIONS = {
+    "open": "start_video",
+    "search": "play_keyword",
+    "download": "download",
+    "record": "record",
+    "replay": "replay",
+}
+# These use the screen and the speaker loopback, nothing else may run while they do
+EXCLUSIVE = {"record", "replay"}
+# Sent down the queue to shut a worker down
+STOP = None
+
+
+class JobGate:
+    """
+    Ordinary jobs run side by side, an exclusive one runs alone: it waits for the running jobs to finish
+    and nothing else starts until it's done. Another browser opening a video or maximizing its window
+    mid-recording would end up on screen and in the speaker loopback.
+    """
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.running = 0
+        self.exclusive_running = False
+        self.exclusive_waiting = 0  # Waiting recordings go first, ordinary jobs can't starve them
+
+    @contextmanager
+    def shared(self):
+        with self.condition:
+            while self.exclusive_running or self.exclusive_waiting:
+                self.condition.wait()
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.condition:
+            self.exclusive_waiting += 1
+            while self.exclusive_running or self.running:
+                self.condition.wait()
+            self.exclusive_waiting -= 1
+            self.exclusive_running = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.exclusive_running = False
+                self.condition.notify_all()
+
+
+class BrowserPool:
+    """
+    Keeps size initialized YouTubeAutomation browsers warm and runs queued jobs on whichever one is free.
+    A browser gets replaced after max_jobs jobs, or straight away when a job fails.
+    Extra keyword arguments go to every YouTubeAutomation.
+    """
+    def __init__(self, size:int=2, max_jobs:int=20, **automation_kwargs) -> None:
+        self.size = size
+        self.max_jobs = max_jobs
+        self.automation_kwargs = automation_kwargs
+        # One cache for all the browsers, so they don't overwrite each other's file
+        automation_kwargs.setdefault("search_cache", SearchCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_cache.json")))
+        self.jobs = queue.Queue()
+        self.gate = JobGate()
+        self.ready = threading.Semaphore(0)  # Released once per browser that finished starting up
+        self.workers = [threading.Thread(target=self.worker, args=(i,), daemon=True) for i in range(size)]
+
+    def start(self, wait:bool=True) -> None:
+        """
+        Launches every browser in parallel, by default returns once they're all warm.
+        """
+        for worker in self.workers:
+            worker.start()
+        if wait:
+            for _ in self.workers:
+                self.ready.acquire()
+            logger.info(f"Browser pool ready with {self.size} browsers.")
+
+    def submit(self, action, *args, **kwargs) -> Future:
+        """
+        Queues a job. action is one of ACTIONS ("open", "search", "download", "record", "replay")
+        or a callable that gets the YouTubeAutomation, for jobs that need several steps on the same browser
+        (those run exclusively, since they may record).
+        """
+        if not callable(action) and action not in ACTIONS:
+            raise ValueError(f"Unknown job: {action}")
+        future = Future()
+        self.jobs.put((action, args, kwargs, future))
+        return future
+
+    def new_browser(self, index:int) -> YouTubeAutomation:
+        automation = YouTubeAutomation(window_name=f"AlexBrowser-{index}", **self.automation_kwargs)
+        automation.initialize_driver()
+        return automation
+
+    def worker(self, index:int) -> None:
+        automation = None
+        try:
+            automation = self.new_browser(index)
+        except Exception as e:
+            logger.error(f"Browser {index} failed to start: {e}")
+        self.ready.release()
+        jobs_done = 0
+        while True:
+            job = self.jobs.get()
+            if job is STOP:
+                break
+            action, args, kwargs, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            failed = False
+            try:
+                if automation is None:
+                    automation = self.new_browser(index)
+                if callable(action):
+                    with self.gate.exclusive():
+                        result = action(automation, *args, **kwargs)
+                elif action in EXCLUSIVE:
+                    with self.gate.exclusive():
+                        result = getattr(automation, ACTIONS[action])(*args, **kwargs)
+                else:
+                    with self.gate.shared():
+                        result = getattr(automation, ACTIONS[action])(*args, **kwargs)
+                future.set_result(result)
+            except Exception as e:
+                logger.error(f"Browser {index} job failed: {e}")
+                future.set_exception(e)
+                failed = True
+            jobs_done += 1
+            # Recycle the driver before it gets too stale (or right away if it broke)
+            if failed or jobs_done >= self.max_jobs:
+                logger.info(f"Recycling browser {index} after {jobs_done} jobs.")
+                self.close_browser(automation)
+                automation = None
+                jobs_done = 0
+                # Warm the replacement up now rather than when the next job arrives
+                try:
+                    automation = self.new_browser(index)
+                except Exception as e:
+                    logger.error(f"Browser {index} failed to restart: {e}")
+        self.close_browser(automation)
+
+    def close_browser(self, automation:YouTubeAutomation) -> None:
+        if automation is None or automation.driver is None:
+            return
+        try:
+            automation.clean_up()
+        except Exception as e:
+            logger.error(f"Failed to close browser: {e}")
+        finally:
+            # clean_up didn't get as far as quitting
+            if automation.driver is not None:
+                try:
+                    automation.driver.quit()
+                except Exception as e:
+                    logger.error(f"Failed to quit browser: {e}")
+                automation.driver = None
+
+    def shutdown(self) -> None:
+        """
+        Finishes the queued jobs, then closes every browser.
+        """
+        for _ in self.workers:
+            self.jobs.put(STOP)
+        for worker in self.workers:
+            worker.join()
+        logger.info("Browser pool shut down.")
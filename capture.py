@@ -0,0 +1,163 @@
+import time
+import cv2
+import numpy as np
+from log import logger
+
+
+def frame_view(img):
+    """
+    Wraps the raw BGRA bytes of an mss screenshot as a numpy array without copying them.
+    """
+    return np.frombuffer(img.raw, dtype=np.uint8).reshape(img.height, img.width, 4)
+
+
+class FrameScheduler:
+    """
+    Paces the capture loop to a fixed frame rate using a monotonic clock.
+    Every grabbed frame gets a timestamp and is mapped onto the constant frame rate output,
+    duplicating frames when the capture falls behind and dropping them when it runs ahead.
+    keep_timestamps=False only keeps the count and the last one, for captures that run without a time limit.
+    """
+    def __init__(self, fps:int=30, keep_timestamps:bool=True) -> None:
+        self.fps = fps
+        self.interval = 1 / fps
+        self.start_time = None
+        self.timestamps = [] if keep_timestamps else None  # Capture time of every grabbed frame, relative to start
+        self.grabbed = 0
+        self.last_timestamp = 0
+        self.emitted = 0  # Output frames handed to the encoder so far
+        self.dropped = 0
+        self.duplicated = 0
+        self.stride = 1  # Only grab every Nth output frame, the rest are duplicates
+
+    def start(self) -> None:
+        self.start_time = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def wait(self) -> None:
+        """
+        Sleeps until the next output frame is due, so we don't grab faster than we encode.
+        """
+        delay = (self.emitted + self.stride - 1) * self.interval - self.elapsed()
+        if delay > 0:
+            time.sleep(delay)
+
+    def place(self, timestamp:float) -> int:
+        """
+        Registers a frame grabbed at timestamp (seconds since start) and returns
+        how many output frames it should fill: 0 means drop it, more than 1 means duplicate it.
+        """
+        if self.timestamps is not None:
+            self.timestamps.append(timestamp)
+        self.grabbed += 1
+        self.last_timestamp = timestamp
+        due = int(timestamp * self.fps) + 1
+        count = due - self.emitted
+        if count <= 0:
+            self.dropped += 1
+            return 0
+        self.duplicated += count - 1
+        self.emitted = due
+        return count
+
+    def log_stats(self) -> None:
+        elapsed = self.last_timestamp
+        capture_fps = self.grabbed / elapsed if elapsed > 0 else 0
+        logger.info(f"Target FPS: {self.fps}, actual capture FPS: {capture_fps:.2f}")
+        logger.info(f"Frames captured: {self.grabbed}, written: {self.emitted}, "
+                    f"duplicated: {self.duplicated}, dropped: {self.dropped}")
+
+
+class ChangeDetector:
+    """
+    Cheap check for whether the screen changed since the last kept frame.
+    Compares a thumbnail shrunk by step in both directions with area averaging, so every pixel counts
+    towards it: a ticking clock, a new subtitle line or the thin progress bar still show up,
+    while paused players and static end screens don't.
+    """
+    def __init__(self, step:int=8, tolerance:int=2) -> None:
+        self.step = step
+        self.tolerance = tolerance  # Ignore tiny differences from dithering/scaling
+        self.previous = None
+        # Reused every frame so the check doesn't allocate
+        self.thumb = None
+        self.diff = None
+        self.unchanged = 0
+
+    def changed(self, frame) -> bool:
+        size = (max(1, frame.shape[1] // self.step), max(1, frame.shape[0] // self.step))
+        if self.previous is None or self.previous.shape != (size[1], size[0], frame.shape[2]):
+            self.previous = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            self.thumb = np.empty_like(self.previous)
+            self.diff = np.empty_like(self.previous)
+            return True
+        cv2.resize(frame, size, dst=self.thumb, interpolation=cv2.INTER_AREA)
+        cv2.absdiff(self.thumb, self.previous, dst=self.diff)
+        if self.diff.max() > self.tolerance:
+            # The new thumbnail becomes the reference, the old buffer gets overwritten next time
+            self.previous, self.thumb = self.thumb, self.previous
+            return True
+        self.unchanged += 1
+        return False
+
+
+class QualityController:
+    """
+    Steps the capture quality down when the recorder falls behind and back up once there's headroom again.
+    Each level is (resolution scale, grab every Nth frame slot). Load is the time spent per grab compared to
+    the time available for it, backlog is how much work the encoder has queued up.
+    """
+    LEVELS = [(1.0, 1), (0.75, 1), (0.75, 2), (0.5, 2), (0.5, 3)]
+
+    def __init__(self, interval:float, period:float=2.0, backlog_limit:int=8) -> None:
+        self.interval = interval
+        self.period = period
+        self.backlog_limit = backlog_limit
+        self.level = 0
+        self.work = 0.0
+        self.grabs = 0
+        self.calm_periods = 0  # Stepping back up needs a few good periods in a row
+        self.last_check = time.perf_counter()
+
+    @property
+    def scale(self) -> float:
+        return self.LEVELS[self.level][0]
+
+    @property
+    def stride(self) -> int:
+        return self.LEVELS[self.level][1]
+
+    @property
+    def name(self) -> str:
+        return f"{int(self.scale * 100)}% size, 1/{self.stride} fps"
+
+    def observe(self, work_time:float) -> None:
+        self.work += work_time
+        self.grabs += 1
+
+    def update(self, backlog:int) -> bool:
+        """
+        Called every loop, only decides once per period. Returns True when the level changed.
+        """
+        now = time.perf_counter()
+        if now - self.last_check < self.period:
+            return False
+        load = self.work / self.grabs / (self.interval * self.stride) if self.grabs else 0
+        self.work = 0.0
+        self.grabs = 0
+        self.last_check = now
+
+        if (load > 0.9 or backlog > self.backlog_limit) and self.level < len(self.LEVELS) - 1:
+            self.level += 1
+            self.calm_periods = 0
+            logger.warning(f"Recorder falling behind (load {load:.2f}, backlog {backlog}), quality down to {self.name}")
+            return True
+        self.calm_periods = self.calm_periods + 1 if load < 0.5 and backlog <= 1 else 0
+        if self.calm_periods >= 3 and self.level > 0:
+            self.level -= 1
+            self.calm_periods = 0
+            logger.info(f"Recorder has headroom (load {load:.2f}), quality up to {self.name}")
+            return True
+        return False
@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+from log import logger
+
+try:
+    import win32file
+    import win32event
+    import win32con
+    import pywintypes
+except ImportError:
+    win32file = None
+
+# inotify flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+# ReadDirectoryChangesW actions
+FILE_ACTION_ADDED = 1
+FILE_ACTION_RENAMED_NEW_NAME = 5
+
+
+class DownloadWatcher:
+    """
+    Waits for a new file with the given extension to show up in a folder.
+    Chrome downloads into a .crdownload file and renames it when it's done, so the rename is the signal.
+    Create it before the download starts: whatever is already in the folder is ignored,
+    which is how we know the file belongs to this download and not an older one.
+    Uses inotify on Linux and ReadDirectoryChangesW on Windows, and polls the folder if neither works.
+    """
+    def __init__(self, folder:str, extension:str=".mp4", poll_interval:float=0.5) -> None:
+        self.folder = folder
+        self.extension = extension
+        self.poll_interval = poll_interval  # Also how often a wait checks for cancel/timeout
+        self.backend = None
+        self.fd = None
+        self.handle = None
+        os.makedirs(folder, exist_ok=True)
+        # Watch first, then list the folder, so nothing can land in between unnoticed
+        try:
+            if sys.platform.startswith("linux"):
+                self.start_inotify()
+            elif sys.platform == "win32" and win32file is not None:
+                self.start_windows()
+        except OSError as e:
+            logger.warning(f"Couldn't watch {folder} for changes, polling instead: {e}")
+            self.close()
+        self.existing = set(self.finished_files())
+        logger.info(f"Watching {folder} for new {extension} files ({self.backend or 'polling'}).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def finished_files(self) -> list:
+        with os.scandir(self.folder) as entries:
+            return [entry.name for entry in entries if entry.is_file() and self.is_finished(entry.name)]
+
+    def is_finished(self, name:str) -> bool:
+        return name.endswith(self.extension)
+
+    def start_inotify(self) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        if libc.inotify_add_watch(fd, os.fsencode(self.folder), IN_MOVED_TO | IN_CLOSE_WRITE) < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        self.backend = "inotify"
+
+    def start_windows(self) -> None:
+        try:
+            self.handle = win32file.CreateFile(
+                self.folder,
+                0x0001,  # FILE_LIST_DIRECTORY
+                win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+                None,
+                win32con.OPEN_EXISTING,
+                win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
+                None
+            )
+            self.buffer = win32file.AllocateReadBuffer(8192)
+            self.overlapped = pywintypes.OVERLAPPED()
+            self.overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+            self.request_changes()
+        except pywintypes.error as e:
+            raise OSError(e.winerror, e.strerror)
+        self.backend = "ReadDirectoryChangesW"
+
+    def request_changes(self) -> None:
+        win32file.ReadDirectoryChangesW(self.handle, self.buffer, False,
+                                        win32con.FILE_NOTIFY_CHANGE_FILE_NAME, self.overlapped)
+
+    def read_inotify(self, timeout:float) -> list:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def read_windows(self, timeout:float) -> list:
+        if win32event.WaitForSingleObject(self.overlapped.hEvent, int(timeout * 1000)) != win32event.WAIT_OBJECT_0:
+            return []
+        size = win32file.GetOverlappedResult(self.handle, self.overlapped, True)
+        changes = win32file.FILE_NOTIFY_INFORMATION(self.buffer, size) if size else []
+        win32event.ResetEvent(self.overlapped.hEvent)
+        self.request_changes()
+        if not size:
+            # The buffer overflowed, only a rescan can tell what happened
+            return self.finished_files()
+        return [name for action, name in changes if action in (FILE_ACTION_ADDED, FILE_ACTION_RENAMED_NEW_NAME)]
+
+    def poll(self, timeout:float) -> list:
+        time.sleep(timeout)
+        return self.finished_files()
+
+    def new_file(self, names:list) -> str:
+        for name in names:
+            if self.is_finished(name) and name not in self.existing and os.path.isfile(os.path.join(self.folder, name)):
+                return os.path.join(self.folder, name)
+        return None
+
+    def wait(self, timeout:float=None, cancel=None) -> str:
+        """
+        Blocks until the download finishes and returns its full path.
+        Returns None on timeout (seconds) or when cancel (a threading.Event) gets set.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        read = {"inotify": self.read_inotify, "ReadDirectoryChangesW": self.read_windows}.get(self.backend, self.poll)
+        while True:
+            if cancel is not None and cancel.is_set():
+                logger.info("Download wait cancelled.")
+                return None
+            remaining = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            if remaining <= 0:
+                # One last look in case an event got lost
+                found = self.new_file(self.finished_files())
+                if found is None:
+                    logger.error(f"No new {self.extension} file in {self.folder} after {timeout}s.")
+                return found
+            try:
+                found = self.new_file(read(remaining))
+            except OSError as e:
+                logger.warning(f"Folder watch failed, polling instead: {e}")
+                self.close()
+                read = self.poll
+                continue
+            if found is not None:
+                logger.info(f"Download finished: {found}")
+                return found
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.handle is not None:
+            self.handle.Close()
+            self.handle = None
+        self.backend = None
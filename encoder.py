@@ -0,0 +1,272 @@
+import os
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import tracing
+from log import logger
+
+
+class FFmpegWriter:
+    """
+    Keeps a single ffmpeg process open and feeds it raw frames over stdin,
+    so the video gets encoded while the capture is still running.
+    container "mp4" is a regular MP4 (only playable once closed), "fmp4" a fragmented MP4 and
+    "hls" a playlist (output_file should be .m3u8) with 2 second segments. The last two are
+    playable up to the last flushed fragment/segment, so a crash doesn't lose the recording
+    and other tools can read it while it's still being written.
+    """
+    def __init__(self, output_file:str, width:int, height:int, fps:int, pix_fmt:str="bgr24", container:str="mp4") -> None:
+        self.output_file = output_file
+        self.frames_written = 0
+        self.bytes_written = 0
+        if container == "fmp4":
+            # Every keyframe starts a new fragment, the moov is written up front
+            output_args = ["-g", str(fps * 2), "-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+        elif container == "hls":
+            # The playlist gets a new entry as soon as each segment is complete
+            output_args = ["-g", str(fps * 2), "-f", "hls", "-hls_time", "2", "-hls_list_size", "0",
+                           "-hls_playlist_type", "event"]
+        else:
+            output_args = []
+        ffmpeg_cmd = [
+            "ffmpeg", "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",                          # Raw frames straight from the capture loop
+            "-pix_fmt", pix_fmt,
+            "-s", f"{width}x{height}",
+            "-framerate", str(fps),                    # The capture scheduler keeps this rate exact
+            "-i", "-",                                 # Read from stdin
+            "-c:v", "libx264",
+            "-preset", "veryfast",                     # Has to keep up with the capture in real time
+            "-pix_fmt", "yuv420p",
+            *output_args,
+            output_file
+        ]
+        self.process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+        logger.info(f"Started streaming encoder for {output_file} ({width}x{height} @ {fps} fps).")
+
+    def backlog(self) -> int:
+        # Writes block when ffmpeg is behind, so that shows up as capture latency instead
+        return 0
+
+    def write(self, frame) -> None:
+        """
+        Sends one frame to ffmpeg. Accepts anything that exposes a contiguous buffer
+        (numpy array, bytes, memoryview), nothing gets copied on the python side.
+        """
+        data = memoryview(frame).cast("B")
+        self.process.stdin.write(data)
+        self.frames_written += 1
+        self.bytes_written += data.nbytes
+
+    def close(self) -> str:
+        """
+        Closes stdin so ffmpeg can flush the last frames, then waits for it to exit.
+        """
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        with tracing.span("ffmpeg.flush"):
+            self.process.wait()
+        tracing.count("encoder.frames_written", self.frames_written)
+        tracing.count("encoder.bytes_written", self.bytes_written)
+        if self.process.returncode != 0:
+            logger.error(f"ffmpeg exited with code {self.process.returncode} while encoding {self.output_file}")
+        logger.info(f"Streaming encoder finished, {self.frames_written} frames written.")
+        return self.output_file
+
+
+@tracing.traced("ffmpeg.mux")
+def mux_audio(video_file:str, audio_file:str, output_file:str, audio_offset:float=0.0) -> str:
+    """
+    Combines an already encoded video with the recorded audio.
+    The video stream is copied, so this only takes a couple of seconds.
+    audio_offset is how many seconds after the first video frame the audio started.
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-y",
+        "-loglevel", "error",
+        "-i", video_file,
+        "-itsoffset", str(audio_offset),           # Line the audio up with the first frame
+        "-i", audio_file,
+        "-c:v", "copy",                            # No re-encode, the video is already h264
+        "-c:a", "aac",
+        "-shortest",                               # Match video length to shortest input
+        output_file
+    ]
+    subprocess.run(ffmpeg_cmd)
+    return output_file
+
+
+def encode_jpegs(jpegs:list, fps:int, output_file:str) -> str:
+    """
+    Encodes a list of already compressed JPEG frames into an h264 video.
+    ffmpeg decodes them itself, so nothing gets decompressed on the python side.
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-y",
+        "-loglevel", "error",
+        "-f", "image2pipe",                        # Back to back JPEGs on stdin
+        "-c:v", "mjpeg",
+        "-framerate", str(fps),
+        "-i", "-",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        output_file
+    ]
+    process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+    try:
+        for jpeg in jpegs:
+            process.stdin.write(memoryview(jpeg).cast("B"))
+        process.stdin.close()
+    except BrokenPipeError:
+        logger.error(f"ffmpeg stopped unexpectedly while encoding {output_file}")
+    process.wait()
+    return output_file
+
+
+def write_frame_list(list_file:str, runs:list, fps:int) -> str:
+    """
+    Writes an ffmpeg concat list of (image file name, frame count) runs,
+    so every distinct frame is stored once and just stays on screen for its duration.
+    """
+    with open(list_file, "w") as file:
+        for name, count in runs:
+            file.write(f"file '{name}'\nduration {count / fps}\n")
+        # The concat demuxer ignores the last duration unless the last file is listed again
+        if runs:
+            file.write(f"file '{runs[-1][0]}'\n")
+    return list_file
+
+
+class SegmentEncoder:
+    """
+    Cuts the capture into fixed-length segments. Frames are saved as PNGs while capturing,
+    every finished segment is encoded on a worker pool while the next one is still being captured,
+    and at the end the segments are joined with a stream copy.
+    Same write/close interface as FFmpegWriter.
+    scale (set by the quality controller) shrinks the saved frames from the next segment on,
+    every segment is scaled back to the full size when encoded so they still join without re-encoding.
+    """
+    def __init__(self, output_file:str, work_dir:str, fps:int, segment_seconds:int=10, workers:int=None) -> None:
+        self.output_file = output_file
+        self.work_dir = work_dir
+        self.fps = fps
+        self.frames_per_segment = int(fps * segment_seconds)
+        os.makedirs(work_dir, exist_ok=True)
+        # PNG compression is the slow part, spread it over a few threads
+        self.save_pool = ThreadPoolExecutor(max_workers=4)
+        # The encodes are separate ffmpeg processes, the pool threads only wait on them
+        self.encode_pool = ThreadPoolExecutor(max_workers=workers or max(1, os.cpu_count() // 2))
+        self.segment_files = []
+        self.encodes = []
+        self.size = None  # Full output size, taken from the first frame
+        self.scale = 1.0
+        self.start_segment()
+
+    def backlog(self) -> int:
+        return sum(not save.done() for save in self.saves) + sum(not encode.done() for encode in self.encodes)
+
+    def start_segment(self) -> None:
+        self.segment_dir = os.path.join(self.work_dir, f"segment_{len(self.segment_files):04d}")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.runs = []  # [png name, frame count]
+        self.saves = []
+        self.last_frame = None
+        self.frame_count = 0
+        # Quality only changes between segments
+        self.segment_scale = self.scale
+
+    def save_frame(self, path:str, frame, scale:float) -> None:
+        tracer = tracing.active()
+        start = time.perf_counter()
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        cv2.imwrite(path, frame)
+        if tracer:
+            # One per frame, so only in the stats and not a trace line each
+            tracer.observe("frame.save", time.perf_counter() - start)
+            tracer.count("frames.saved")
+
+    def write(self, frame) -> None:
+        if self.size is None:
+            self.size = (frame.shape[1], frame.shape[0])
+        # Repeated frames are the same object, they only extend the last run
+        if frame is self.last_frame:
+            self.runs[-1][1] += 1
+        else:
+            name = f"frame_{len(self.runs):04d}.png"
+            # The scale goes along with the frame, the next segment may have changed it by the time this runs
+            self.saves.append(self.save_pool.submit(self.save_frame, os.path.join(self.segment_dir, name), frame, self.segment_scale))
+            self.runs.append([name, 1])
+            self.last_frame = frame
+        self.frame_count += 1
+        if self.frame_count == self.frames_per_segment:
+            self.finish_segment()
+
+    def finish_segment(self) -> None:
+        if not self.runs:
+            return
+        segment_file = os.path.join(self.work_dir, f"segment_{len(self.segment_files):04d}.mp4")
+        self.segment_files.append(segment_file)
+        self.encodes.append(self.encode_pool.submit(self.encode_segment, self.segment_dir, self.runs, self.saves, segment_file))
+        logger.info(f"Segment {len(self.segment_files)} captured at {int(self.segment_scale * 100)}% size, encoding in the background.")
+        self.start_segment()
+
+    @tracing.traced("segment.encode")
+    def encode_segment(self, segment_dir:str, runs:list, saves:list, segment_file:str) -> str:
+        # Wait for this segment's PNGs to be on disk
+        for save in saves:
+            save.result()
+        frame_list = write_frame_list(os.path.join(segment_dir, "frames.txt"), runs, self.fps)
+        ffmpeg_cmd = [
+            "ffmpeg", "-y",
+            "-loglevel", "error",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", frame_list,
+            "-vf", f"scale={self.size[0]}:{self.size[1]}",  # Same size for every segment, whatever it was saved at
+            "-r", str(self.fps),                       # Constant frame rate so the segments join cleanly
+            # The repeated last entry in the list adds a frame, without a cap every segment would
+            # run one frame long and the joined video would drift away from the audio
+            "-frames:v", str(sum(count for _, count in runs)),
+            "-c:v", "libx264",
+            "-pix_fmt", "yuv420p",
+            segment_file
+        ]
+        subprocess.run(ffmpeg_cmd)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        return segment_file
+
+    def close(self) -> str:
+        """
+        Encodes the last partial segment, waits for all of them and joins them without re-encoding.
+        """
+        self.finish_segment()
+        for encode in self.encodes:
+            encode.result()
+        self.save_pool.shutdown()
+        self.encode_pool.shutdown()
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+
+        segment_list = os.path.join(self.work_dir, "segments.txt")
+        with open(segment_list, "w") as file:
+            for segment_file in self.segment_files:
+                file.write(f"file '{os.path.abspath(segment_file)}'\n")
+        ffmpeg_cmd = [
+            "ffmpeg", "-y",
+            "-loglevel", "error",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", segment_list,
+            "-c", "copy",                              # Just join them, no re-encode
+            self.output_file
+        ]
+        subprocess.run(ffmpeg_cmd)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        logger.info(f"Joined {len(self.segment_files)} segments into {self.output_file}")
+        return self.output_file
@@ -2,6 +2,7 @@ import customtkinter as ctk
 import threading
 import re
 from player import YouTubeAutomation
+from level_meter import LiveLevelMeter
 
 
 class YouTubeApp(ctk.CTk):
@@ -41,6 +42,14 @@ class YouTubeApp(ctk.CTk):
         self.recording_label = ctk.CTkLabel(self, text="Recording started, press q to end early", font=("Segoe UI", 16), text_color="lime", bg_color="#1e2227")
         self.recording_label.pack_forget()
 
+        # Live audio meter and stop button while recording (hidden by default).
+        self.meter_label = ctk.CTkLabel(self, text="", font=("Segoe UI", 14), text_color="white", bg_color="#1e2227")
+        self.meter_label.pack_forget()
+        self.stop_button = ctk.CTkButton(self, text="Stop", command=self.stop_recording, font=("Segoe UI", 16), fg_color="#d063a7", hover_color="#e070b1", width=100)
+        self.stop_button.pack_forget()
+        self.meter = None
+        self.stop_event = None
+
     def load(self):
         # Prepare for initialization.
         self.load_button.configure(state="disabled")
@@ -143,7 +152,7 @@ class YouTubeApp(ctk.CTk):
         else:
             self.invalid_url_label.pack_forget()
         self.youtube_automation_thread = threading.Thread(
-            target=self.youtube_automation.youtube_search, args=(keyword,)
+            target=self.youtube_automation.play_keyword, args=(keyword,)
         )
         self.youtube_automation_thread.start()
 
@@ -159,8 +168,43 @@ class YouTubeApp(ctk.CTk):
 
         self.invalid_url_label.pack_forget()
         self.recording_label.pack(pady=10)  # Show the recording label
-        self.youtube_automation_thread = threading.Thread(target=self.youtube_automation.record, args=(duration,))
+        self.meter = LiveLevelMeter()
+        self.stop_event = threading.Event()
+        self.youtube_automation_thread = threading.Thread(
+            target=self.youtube_automation.record, args=(duration,),
+            kwargs={"meter": self.meter, "stop_event": self.stop_event}
+        )
         self.youtube_automation_thread.start()
+        self.meter_label.configure(text="Waiting for audio...", text_color="white")
+        self.meter_label.pack(pady=5)
+        self.stop_button.pack(pady=5)
+        self.after(200, self.poll_meter)
+
+    def poll_meter(self):
+        # Runs on the Tk thread, only picks up what the recorder thread already computed.
+        reading = self.meter.drain()
+        if reading:
+            if reading.clipped_total:
+                color = "red"
+            elif reading.silent:
+                color = "gray"
+            else:
+                color = "lime"
+            self.meter_label.configure(
+                text=f"RMS {reading.rms_db:.1f} dB | Peak {reading.peak_db:.1f} dB | Clipped {reading.clipped_total}",
+                text_color=color
+            )
+        if self.youtube_automation_thread.is_alive():
+            self.after(200, self.poll_meter)
+        else:
+            self.meter_label.pack_forget()
+            self.stop_button.pack_forget()
+            self.recording_label.pack_forget()
+
+    def stop_recording(self):
+        # Bad take (silence, clipping), end it right away.
+        if self.stop_event:
+            self.stop_event.set()
 
     def show_invalid_url_message(self):
         self.invalid_url_label.pack(pady=10)
@@ -0,0 +1,52 @@
+import numpy as np
+from collections import deque, namedtuple
+from audio_measure import rms_to_db
+
+# One meter update, levels in dBFS
+MeterReading = namedtuple("MeterReading", ["rms_db", "peak_db", "clipped", "clipped_total", "silent"])
+
+
+class LiveLevelMeter:
+    """
+    Rolling RMS, peak and clipping count for every audio chunk while recording.
+    Readings go onto a deque, append and popleft are atomic in CPython,
+    so the recorder thread and the GUI can share it without a lock.
+    """
+    def __init__(self, window_chunks:int=3, clip_level:float=0.999, silence_db:float=-60.0) -> None:
+        self.clip_level = clip_level
+        self.silence_db = silence_db
+        self.window = deque(maxlen=window_chunks)  # (sum of squares, sample count) of the last chunks
+        self.readings = deque(maxlen=100)  # The GUI only cares about the newest, old ones fall off
+        self.clipped_total = 0
+
+    def update(self, samples) -> None:
+        """
+        Audio listener, gets every float (-1..1) chunk from the recorder thread.
+        """
+        magnitude = np.abs(np.asarray(samples, dtype=np.float32))
+        if magnitude.size == 0:
+            return
+        self.window.append((float(np.square(magnitude, dtype=np.float64).sum()), magnitude.size))
+        squares = sum(chunk[0] for chunk in self.window)
+        count = sum(chunk[1] for chunk in self.window)
+        clipped = int(np.count_nonzero(magnitude >= self.clip_level))
+        self.clipped_total += clipped
+        rms_db = rms_to_db(np.sqrt(squares / count))
+        self.readings.append(MeterReading(
+            rms_db=rms_db,
+            peak_db=rms_to_db(float(magnitude.max())),
+            clipped=clipped,
+            clipped_total=self.clipped_total,
+            silent=rms_db < self.silence_db
+        ))
+
+    def drain(self) -> MeterReading:
+        """
+        Empties the channel and returns the newest reading, or None if nothing new arrived.
+        """
+        latest = None
+        while True:
+            try:
+                latest = self.readings.popleft()
+            except IndexError:
+                return latest
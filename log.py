@@ -1,15 +1,130 @@
+import os
+import json
+import queue
+import atexit
 import logging
+import threading
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FILE = "app.log"
+# Set APP_LOG_JSON=1 for one JSON object per line in the log file (the console stays readable)
+JSON_LOGS = os.environ.get("APP_LOG_JSON") == "1"
+# Rotates by size by default, APP_LOG_ROTATE="midnight" (or any TimedRotatingFileHandler "when") rotates by time
+ROTATE_WHEN = os.environ.get("APP_LOG_ROTATE")
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+# Each line that logs gets this many info/debug messages per period (seconds), the rest are dropped and counted
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_PERIOD = 5.0
+
+# Might change later, I like this format for now
+TEXT_FORMAT = '%(asctime)s | %(levelname)s: %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+            "site": f"{record.filename}:{record.lineno}",
+        }
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most burst info/debug records per period through from each line of code that logs.
+    The dropped ones are counted and mentioned on the next message from that line. Warnings and up always pass.
+    """
+    def __init__(self, burst:int=RATE_LIMIT_BURST, period:float=RATE_LIMIT_PERIOD) -> None:
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.sites = {}  # (file, line) -> [window start, messages let through, messages dropped]
+        self.lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or record.created - site[0] >= self.period:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [record.created, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def file_handler() -> logging.Handler:
+    if ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(LOG_FILE, when=ROTATE_WHEN, backupCount=BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding="utf-8")
+    handler.setFormatter(JsonFormatter() if JSON_LOGS else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+# Worker processes log through this queue to the main process (see worker_queue)
+process_queue = None
+process_listener = None
+
+
+def worker_queue():
+    """
+    The queue worker processes send their records through. Pass it to the worker and call init_worker with it
+    first thing there. Only the main process ever has the log file open, Windows can't roll over a file
+    that another process still holds.
+    """
+    global process_queue, process_listener
+    if process_queue is None:
+        process_queue = multiprocessing.Queue()
+        process_listener = QueueListener(process_queue, *listener.handlers, respect_handler_level=True)
+        process_listener.start()
+        atexit.register(process_listener.stop)
+    return process_queue
+
+
+def init_worker(log_queue) -> None:
+    """
+    Sends this worker process's records to the main process's log.
+    """
+    queue_handler.queue = log_queue
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
 
 # Configure the logger
-logging.basicConfig(
-    level=logging.INFO,
-    # Might change later, I like this format for now
-    format='%(asctime)s | %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+# Callers only put the record on a queue, the file and console writes happen on the listener's thread,
+# so logging from the capture loop or the automation threads never waits on disk or the terminal
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+queue_handler = QueueHandler(queue.SimpleQueue())
+# Only the message gets formatted on the caller's side, the listener's handlers add the rest
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+queue_handler.addFilter(RateLimitFilter())
+if multiprocessing.parent_process() is None:
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener = QueueListener(queue_handler.queue, file_handler(), console_handler, respect_handler_level=True)
+    listener.start()
+    # Flushes whatever is still queued when the program exits
+    atexit.register(listener.stop)
+else:
+    # A worker process never opens the log file, it prints until init_worker hands it the main process's queue
+    logging.basicConfig(level=logging.INFO, handlers=[console_handler])
+    listener = None
 
 # Get the logger
 logger = logging.getLogger("AppLogger")
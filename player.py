@@ -2,14 +2,25 @@ import os
 import re
 import sys
 import time
+import json
+import socket
+import winreg
+import shutil
+import zipfile
+from urllib.parse import urlencode
 import win32gui
+import win32api
 import win32con
 import threading
+import tracing
 from log import logger
 import pygetwindow as gw
 from audio_measure import *
 from selenium import webdriver
 from record_screen import record_screen
+from replay_buffer import replay_buffer
+from download_watcher import DownloadWatcher
+from search_cache import SearchCache
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
@@ -17,16 +28,53 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+
+# Installed into the page: clicks skip buttons itself as soon as they show up and queues what happened.
+# Navigating drops it, so it's (re)installed by the same call that drains the queue.
+AD_OBSERVER_JS = """
+if (!window.__adObserver) {
+    window.__adEvents = [];
+    let adShowing = false;
+    const check = () => {
+        const player = document.getElementById('movie_player');
+        const showing = !!player && player.classList.contains('ad-showing');
+        if (showing !== adShowing) {
+            adShowing = showing;
+            window.__adEvents.push({type: showing ? 'ad_start' : 'ad_end', time: Date.now()});
+        }
+        const skip = document.querySelector('.ytp-skip-ad-button, .ytp-ad-skip-button, .ytp-ad-skip-button-modern');
+        if (skip && skip.offsetParent !== null) {
+            skip.click();
+            window.__adEvents.push({type: 'skip', time: Date.now()});
+        }
+    };
+    window.__adObserver = new MutationObserver(check);
+    window.__adObserver.observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style']});
+    check();
+}
+const events = window.__adEvents;
+window.__adEvents = [];
+return events;
+"""
+
+# Every search result's title, link and whether it's sponsored
+SEARCH_RESULTS_JS = """
+return Array.from(document.querySelectorAll('a#video-title'), (a) => ({
+    title: a.textContent.trim(),
+    href: a.href,
+    ad: !a.href || /\\bAd\\b/.test(a.getAttribute('aria-label') || '') ||
+        !!a.closest('ytd-ad-slot-renderer, ytd-promoted-video-renderer, ytd-in-feed-ad-layout-renderer')
+}));
+"""
 
 
 class YouTubeAutomation:
-    def __init__(self, adblock=True, fullscreen=False, showall=False):
+    def __init__(self, adblock=True, fullscreen=False, showall=False, window_name="AlexBrowser", fast_start=False, debug_port=None, search_cache=None):
         self.unavailable = True # If the video is private/invalid url/deleted
         self.driver = None
         self.window = None
         self.showall = showall
-        self.lastdownload = time.time()
         self.chrome_options = Options()
         self.lock = threading.Lock()
         self.adblock = adblock
@@ -34,11 +82,22 @@ class YouTubeAutomation:
         self.fullscreen = fullscreen
         self.path = None
         self.firstlink = True # Keep browser hidden till first link is requested
+        self.window_name = window_name # Has to be unique when several browsers run at once
+        self.fast_start = fast_start # Cached driver, persistent profile, no cookie clean up
+        self.debug_port = debug_port # Attach to a Chrome already running with --remote-debugging-port
+        self.popup_monitor_thread = None
+        self.monitor_stop = threading.Event()
+        self.ads_skipped = 0
+        self.download_cancel = threading.Event() # Set from another thread to give up waiting on a download
+        self.search_cache = search_cache # Keyword -> link of earlier searches, made in initialize_driver if not given
         logger.info(f"Running Adblock: {self.adblock}, Fullscreen: {self.fullscreen}, Show everything: {self.showall}")
 
+    @tracing.traced("initialize_driver")
     def initialize_driver(self) -> None:
         """
         Preloads the driver for a smooother run and adds Ublock Origin.
+        With fast_start the resolved chromedriver is cached, the profile is kept between runs
+        (cookie consent and uBlock stay set up) and an already running browser on debug_port is reused.
         """
             # Determine current path
         if getattr(sys, 'frozen', False):
@@ -48,16 +107,33 @@ class YouTubeAutomation:
             # If running the script in Python
             self.path = os.path.dirname(os.path.abspath(__file__))
         self.download_folder = os.path.join(self.path, 'Downloads')
+        if self.search_cache is None:
+            self.search_cache = SearchCache(os.path.join(self.path, "search_cache.json"))
             # Make sure folder exists
         if not os.path.exists(self.download_folder):
             os.makedirs(self.download_folder)
             # Configure settings
         logger.info(f"Download folder: {self.download_folder}")
+        if self.debug_port and self.port_open(self.debug_port):
+            # Attach instead of launching, the browser is already set up
+            logger.info(f"Attaching to the browser on port {self.debug_port}.")
+            self.chrome_options.debugger_address = f"127.0.0.1:{self.debug_port}"
+            self.driver = webdriver.Chrome(service=Service(self.resolve_driver()), options=self.chrome_options)
+            self.count_driver_calls()
+            self.window = self.find_window()
+            logger.info("Driver loaded.")
+            return
+        if self.debug_port:
+            # Let the next run attach to this browser
+            self.chrome_options.add_argument(f"--remote-debugging-port={self.debug_port}")
+        if self.fast_start:
+            self.profile_dir = os.path.join(self.path, "ChromeProfile", self.window_name)
+            self.chrome_options.add_argument(f"--user-data-dir={self.profile_dir}")
         self.chrome_options.add_argument("--start-minimized")
         self.chrome_options.add_argument("--disable-infobars")
         self.chrome_options.add_argument("--enable-automation")
-        #If you want to change the name, also changed the getWindowsWithTitle below
-        self.chrome_options.add_argument("--window-name=AlexBrowser")      
+        # The window is found by this name below (getWindowsWithTitle)
+        self.chrome_options.add_argument(f"--window-name={self.window_name}")
         # Install pre-downloaded uBlock Origin extension crx
         self.chrome_options.add_experimental_option("prefs", {
             "download.default_directory": self.download_folder,  # Set the default download directory
@@ -65,44 +141,197 @@ class YouTubeAutomation:
             "download.directory_upgrade": True,  # Auto upgrade directory if needed
             "safebrowsing.enabled": True  # Disable safe browsing
             })
+        unpacked_argument = None
         if self.adblock:
             try:
                 logger.info("Loading Adblock...")
                 crx_path = os.path.join(self.path, 'ublock.crx')
                 logger.info(f"Assumed Ublock crx path: {crx_path}")
-                self.chrome_options.add_extension(crx_path)
+                if self.fast_start:
+                    # Unpacked once, then just loaded from disk instead of installing the crx every launch
+                    unpacked_argument = f"--load-extension={self.unpack_extension(crx_path)}"
+                    self.chrome_options.add_argument(unpacked_argument)
+                else:
+                    self.chrome_options.add_extension(crx_path)
                 self.adblock = True
-                logger.info("Successfully loaded Adblock.")
             except Exception as e:
                 logger.error(f"Error loading Adblock: {e}")
                 logger.info(f"Switching to non-Adblock mode.")
+                self.adblock = False
         else:
             logger.info("Running non-Adblock mode.")
 
-        self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=self.chrome_options)
-        self.driver.delete_all_cookies() # Clean up old caches from previous runs in case it didn't properly exit
-        logger.info("Cleaned up cache.")
-        self.window = gw.getWindowsWithTitle("AlexBrowser")[0]
+        self.driver = webdriver.Chrome(service=Service(self.resolve_driver()), options=self.chrome_options)
+        if unpacked_argument and not self.extension_running():
+            # Chrome can drop --load-extension without a word (branded builds ignore it from 137 on),
+            # so fall back to installing the crx the normal way
+            logger.warning("Unpacked uBlock didn't load, restarting with the crx.")
+            self.driver.quit()
+            self.chrome_options.arguments.remove(unpacked_argument)
+            try:
+                self.chrome_options.add_extension(crx_path)
+            except Exception as e:
+                logger.error(f"Error loading Adblock: {e}")
+                logger.info(f"Switching to non-Adblock mode.")
+                self.adblock = False
+            self.driver = webdriver.Chrome(service=Service(self.resolve_driver()), options=self.chrome_options)
+        if self.adblock:
+            logger.info("Successfully loaded Adblock.")
+        self.count_driver_calls()
+        consent_marker = os.path.join(self.profile_dir, "cookies_rejected") if self.fast_start else None
+        if not self.fast_start:
+            self.driver.delete_all_cookies() # Clean up old caches from previous runs in case it didn't properly exit
+            logger.info("Cleaned up cache.")
+        self.window = self.find_window()
         self.hide_window() # Hide the window then reveal it later when a link is opened
-        self.driver.get('https://www.youtube.com/')
-        logger.info("Rejecting cookies.")
-        self.reject_cookies()
+        if consent_marker and (os.path.exists(consent_marker) or self.has_consent_cookie()):
+            # The profile remembers the cookie choice, no need to load youtube and wait for the banner
+            logger.info("Cookie choice already saved in this profile.")
+        else:
+            self.driver.get('https://www.youtube.com/')
+            logger.info("Rejecting cookies.")
+            self.reject_cookies()
+            if consent_marker:
+                # Also when nothing got clicked, regions without a banner would wait out the timeout every launch
+                open(consent_marker, "w").close()
+        logger.info("Driver loaded.")
+
+    def has_consent_cookie(self) -> bool:
+        """
+        Whether the profile holds YouTube's cookie choice (SOCS, or CONSENT on older setups).
+        Read over CDP, get_cookie only sees the open page and that's still about:blank here.
+        """
+        try:
+            cookies = self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        except WebDriverException as e:
+            logger.warning(f"Couldn't read the profile cookies: {e}")
+            return False
+        return any(
+            cookie["domain"].endswith("youtube.com") and (cookie["name"] == "SOCS" or
+            (cookie["name"] == "CONSENT" and not cookie["value"].startswith("PENDING")))
+            for cookie in cookies
+        )
+
+    def count_driver_calls(self) -> None:
+        # Every WebDriver command is an HTTP round trip to chromedriver, worth counting when tracing
+        if tracing.active():
+            self.driver.execute = tracing.counted(self.driver.execute, "webdriver.calls")
+
+    def resolve_driver(self) -> str:
+        """
+        Returns the chromedriver path. ChromeDriverManager (network lookups) only runs
+        when Chrome got updated or the cached driver is gone.
+        """
+        if not self.fast_start:
+            return ChromeDriverManager().install()
+        cache_file = os.path.join(self.path, "driver_cache.json")
+        chrome_version = self.chrome_version()
+        try:
+            with open(cache_file) as file:
+                cached = json.load(file)
+            if os.path.isfile(cached["driver"]):
+                if chrome_version is None:
+                    # Better to try the last driver than to hit the network on every launch
+                    logger.warning("Couldn't read the Chrome version, using the cached chromedriver.")
+                    return cached["driver"]
+                if cached["chrome"] == chrome_version:
+                    logger.info(f"Using cached chromedriver for Chrome {chrome_version}.")
+                    return cached["driver"]
+        except (OSError, ValueError, KeyError):
+            pass
+        driver_path = ChromeDriverManager().install()
+        with open(cache_file, "w") as file:
+            json.dump({"chrome": chrome_version, "driver": driver_path}, file)
+        return driver_path
+
+    def chrome_version(self) -> str:
+        """
+        Installed Chrome version, None if it can't be read.
+        BLBeacon is only there once Chrome ran for this user, per-machine installs fall back to chrome.exe's own version.
+        """
+        for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(root, r"Software\Google\Chrome\BLBeacon") as key:
+                    return winreg.QueryValueEx(key, "version")[0]
+            except OSError:
+                pass
+        for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(root, r"Software\Microsoft\Windows\CurrentVersion\App Paths\chrome.exe") as key:
+                    chrome_exe = winreg.QueryValueEx(key, "")[0]
+                info = win32api.GetFileVersionInfo(chrome_exe, "\\")
+                high, low = info["FileVersionMS"], info["FileVersionLS"]
+                return f"{high >> 16}.{high & 0xFFFF}.{low >> 16}.{low & 0xFFFF}"
+            except (OSError, win32api.error):
+                pass
+        return None
+
+    def unpack_extension(self, crx_path:str) -> str:
+        """
+        Extracts the crx (a zip with an extra header, which zipfile skips) next to it, once.
+        The store's _metadata folder is left out, Chrome refuses to load an unpacked extension that has one.
+        """
+        unpacked = os.path.join(self.path, "ublock")
+        if not os.path.exists(os.path.join(unpacked, "manifest.json")):
+            logger.info("Unpacking uBlock Origin.")
+            with zipfile.ZipFile(crx_path) as crx:
+                members = [name for name in crx.namelist() if not name.startswith("_metadata/")]
+                crx.extractall(unpacked, members)
+        # Left behind by older unpacks
+        shutil.rmtree(os.path.join(unpacked, "_metadata"), ignore_errors=True)
+        return unpacked
+
+    def extension_running(self, timeout:float=5) -> bool:
+        """
+        Whether an extension's background page/service worker showed up, i.e. uBlock actually loaded.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                targets = self.driver.execute_cdp_cmd("Target.getTargets", {})["targetInfos"]
+            except WebDriverException as e:
+                logger.warning(f"Couldn't check the loaded extensions: {e}")
+                return False
+            if any(target["url"].startswith("chrome-extension://") for target in targets):
+                return True
+            time.sleep(0.25)
+        return False
+
+    def port_open(self, port:int) -> bool:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return True
+        except OSError:
+            return False
 
+    def find_window(self):
+        """
+        The browser window by its name, or any Chrome window when attached to one we didn't launch.
+        """
+        windows = gw.getWindowsWithTitle(self.window_name) or gw.getWindowsWithTitle("Google Chrome")
+        if not windows:
+            logger.warning("Couldn't find the browser window.")
+            return None
+        return windows[0]
 
 
+    @tracing.traced("start_video")
     def start_video(self, link:str) -> None:
         """
         Check if the video is available, then start playing it if it doesn't start automatically.
         """
         self.driver.get(link)
         logger.info(f"Opening link: {link}")
-        
-        # Start the popup monitor thread
-        if not hasattr(self, "popup_monitor_thread"):
-            self.popup_monitor_thread = threading.Thread(target=self.monitor_ads)
-            self.popup_monitor_thread.daemon = True  # Ensures it doesn't block the program
-            logger.info("Starting monitor thread")
-            self.popup_monitor_thread.start()
+        self.prepare_video()
+
+    def prepare_video(self) -> None:
+        """
+        Everything after the watch page is open in the current tab: ads, availability, fullscreen, play.
+        """
+        if not self.adblock:
+            # Put the observer in right away so a pre-roll gets skipped without waiting for the next poll
+            self.drain_ad_events()
+            self.start_ad_monitor()
         
         # Reveal the window if it's the first time opening a link
         if self.firstlink:
@@ -124,65 +353,102 @@ class YouTubeAutomation:
                 logger.info("Unable to find play button.")
 
 
-    def youtube_search(self, keyword:str) -> None:
-        # Start the popup monitor thread
-        if not hasattr(self, "popup_monitor_thread") and not self.adblock:
-            self.popup_monitor_thread = threading.Thread(target=self.monitor_ads)
-            self.popup_monitor_thread.daemon = True  # Ensures it doesn't block the program
-            logger.info("Starting monitor thread")
-            self.popup_monitor_thread.start()
-        if not self.driver.current_url.startswith("https://www.youtube"):
-            self.driver.get("https://www.youtube.com/")
+    def preload_tab(self, link:str) -> str:
+        """
+        Opens link in a background tab without switching to it, returns the tab's handle (None if that failed).
+        Chrome holds off on playing media in tabs that were never shown, so it stays quiet until open_preloaded.
+        """
+        with self.lock:
+            try:
+                handles = set(self.driver.window_handles)
+                self.driver.execute_cdp_cmd("Target.createTarget", {"url": link, "background": True})
+                new_handles = [handle for handle in self.driver.window_handles if handle not in handles]
+            except WebDriverException as e:
+                logger.warning(f"Couldn't preload {link}: {e}")
+                return None
+        logger.info(f"Preloading {link} in a background tab.")
+        return new_handles[0] if new_handles else None
+
+    def open_preloaded(self, handle:str) -> None:
+        """
+        Closes the current tab and continues in the one preload_tab opened.
+        """
+        self.driver.close()
+        self.driver.switch_to.window(handle)
+        logger.info(f"Switched to preloaded tab: {self.driver.current_url}")
+        self.prepare_video()
+
+    @tracing.traced("youtube_search")
+    def youtube_search(self, keyword:str) -> str:
+        """
+        Opens the first non-sponsored result for keyword and returns its link (None if nothing was found).
+        """
+        if not self.adblock:
+            self.start_ad_monitor()
+        # Straight to the results page, no need to click and type into the search bar
+        self.driver.get("https://www.youtube.com/results?" + urlencode({"search_query": keyword}))
+        logger.info(f"Searching for '{keyword}'.")
         try:
-            # Find and click search bar
-            time.sleep(1.5)
-            search_bar = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.NAME, "search_query"))
-            )
-            search_bar.click()
-            logger.info("Clicked on the YouTube search bar.")
-            time.sleep(0.3)
-            # Clear previous text
-            search_bar.send_keys(Keys.CONTROL + 'a')
-            search_bar.send_keys(Keys.BACKSPACE)
-            # Type the keyword and press Enter
-            search_bar.send_keys(keyword + Keys.RETURN)
-            logger.info(f"Typed '{keyword}' in the search bar and submitted.")
-
-            # Wait for the video results to load
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.ID, "video-title"))
+            # The scan doubles as the wait: it returns nothing until a real result has its link
+            results = WebDriverWait(self.driver, 10, poll_frequency=0.1).until(
+                lambda driver: self.scan_results(driver)
             )
-            logger.info("Video results are loaded.")
-            # Explicit delay for slower machines (it bugs on bad hardware)
-            time.sleep(0.8)
-            # Find the first non-ad video
-            videos = self.driver.find_elements(By.XPATH, "//a[@id='video-title']")
-            for video in videos:
-                aria_label = video.get_attribute("aria-label")
-                if "Ad" not in (aria_label or ""):  # Skip sponsored content
-                    video.click()
-                    logger.info("Clicked on the first non-sponsored video.")
-                    break
-            else:
-                logger.error("No non-sponsored video found.")
-                
-        except (NoSuchElementException, TimeoutException) as e:
+            logger.info(f"Video results are loaded ({len(results)} found).")
+            index, video = next((i, result) for i, result in enumerate(results) if not result["ad"])
+            self.driver.execute_script("document.querySelectorAll('a#video-title')[arguments[0]].click();", index)
+            WebDriverWait(self.driver, 10, poll_frequency=0.1).until(EC.url_contains("/watch"))
+            logger.info(f"Clicked on the first non-sponsored video: {video['title']}")
+            link = video["href"]
+        except WebDriverException as e:
             logger.error(f"An error occurred during search or video selection: {e}")
+            link = None
         # Reveal the window if it's the first time opening a link
         if self.firstlink:
             self.show_window()
             self.firstlink = False
         logger.info("Checking for fullscreen.")
-        if self.fullscreen:
+        if self.fullscreen and link:
             logger.info("Fullscreening.")
-            time.sleep(0.5)
-            self.driver.find_element(By.TAG_NAME, 'body').send_keys('f')
+            try:
+                # The player only takes the key once it's on the page
+                WebDriverWait(self.driver, 10, poll_frequency=0.1).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, "#movie_player video"))
+                )
+                self.driver.find_element(By.TAG_NAME, 'body').send_keys('f')
+            except WebDriverException as e:
+                logger.error(f"An error occurred while fullscreening: {e}")
+        return link
 
+    def play_keyword(self, keyword:str) -> str:
+        """
+        Opens the video keyword resolved to last time if it's cached and still up, searches otherwise.
+        Returns the link that ended up playing.
+        """
+        link = self.search_cache.get(keyword) if self.search_cache else None
+        if link:
+            self.start_video(link)
+            if not self.unavailable:
+                return link
+            logger.info("Cached video is unavailable, searching again.")
+        link = self.youtube_search(keyword)
+        self.check_available()
+        if link and not self.unavailable and self.search_cache:
+            self.search_cache.put(keyword, link)
+        return link
 
-    def reject_cookies(self) -> None:
+    def scan_results(self, driver) -> list:
+        """
+        Titles, links and ad flags of every search result in one round trip.
+        Returns an empty list until at least one non-sponsored result is ready.
+        """
+        results = driver.execute_script(SEARCH_RESULTS_JS) or []
+        return results if any(not result["ad"] for result in results) else []
+
+
+    def reject_cookies(self) -> bool:
         """
         Waits for the 'Reject all' button on YouTube to be clickable and clicks it.
+        Returns True if it was clicked.
         """
         try:
             # Wait for the 'Reject all' button to be clickable
@@ -191,29 +457,60 @@ class YouTubeAutomation:
             )
             button.click()
             logger.info("Clicked the 'Reject all' button (cookies).")
+            return True
         except NoSuchElementException:
             logger.error("Reject cookies page/button not found.")
         except Exception as e:
             logger.info(f"Error in cookie reject: {e}")
+        return False
+
+
+    def start_ad_monitor(self) -> None:
+        if self.popup_monitor_thread is None:
+            self.monitor_stop.clear()
+            self.popup_monitor_thread = threading.Thread(target=self.monitor_ads)
+            self.popup_monitor_thread.daemon = True  # Ensures it doesn't block the program
+            logger.info("Starting monitor thread")
+            self.popup_monitor_thread.start()
 
+    def stop_ad_monitor(self) -> None:
+        if self.popup_monitor_thread is not None:
+            self.monitor_stop.set()
+            self.popup_monitor_thread.join()
+            self.popup_monitor_thread = None
+            logger.info(f"Stopped popup monitor, {self.ads_skipped} ads skipped.")
+
+    def drain_ad_events(self) -> None:
+        """
+        One round trip: makes sure the observer is in the page and collects what it did since the last call.
+        """
+        try:
+            events = self.driver.execute_script(AD_OBSERVER_JS) or []
+        except Exception as e:
+            # Page in the middle of loading, or the browser is gone
+            logger.debug(f"Couldn't reach the ad observer: {e}")
+            return
+        for event in events:
+            if event["type"] == "skip":
+                self.ads_skipped += 1
+                logger.info("Clicked 'Skip Ad' button.")
+            elif event["type"] == "ad_start":
+                logger.info("Ad started.")
+            else:
+                logger.info("Ad finished.")
 
     def monitor_ads(self) -> None:
+        """
+        The observer does the clicking in the page, this only re-installs it after navigations and logs its events.
+        """
         logger.info("Started popup monitor.")
-        while True:
-            time.sleep(0.3)
-            with self.lock:
-                if not self.adblock:
-                    try:
-                        # Check for "Skip" button for ads
-                        skip_ad_button = WebDriverWait(self.driver, 0.5).until(
-                            EC.element_to_be_clickable((By.CLASS_NAME, "ytp-skip-ad-button"))
-                        )
-                        skip_ad_button.click()
-                        logger.info("Clicked 'Skip Ad' button.")
-
-                    except TimeoutException:
-                        # No ad skip button found
-                        pass
+        while not self.monitor_stop.wait(1):
+            # Skip a beat instead of queueing up behind a download that holds the lock
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.drain_ad_events()
+                finally:
+                    self.lock.release()
 
 
     def check_available(self) -> None:
@@ -241,13 +538,15 @@ class YouTubeAutomation:
             # Catch other exceptions that might occur
             self.unavailable = True
             logger.info(f"An error occurred: {e}")
+        if self.unavailable and self.search_cache:
+            self.search_cache.invalidate(self.driver.current_url)
 
 
     def hide_window(self) -> None:
         """
         Completely hides the window.
         """
-        if not self.showall:
+        if not self.showall and self.window is not None:
             win32gui.ShowWindow(self.window._hWnd, win32con.SW_HIDE)
             logger.info("Fully hiding window.")
 
@@ -255,7 +554,7 @@ class YouTubeAutomation:
         """
         Restores and maximizes the Chrome window, and brings it to the foreground.
         """
-        if not self.showall:
+        if not self.showall and self.window is not None:
             try:
                 win32gui.ShowWindow(self.window._hWnd, win32con.SW_RESTORE)
                 logger.info("Attempting to reveal browser window.")
@@ -280,60 +579,40 @@ class YouTubeAutomation:
     def clean_up(self) -> None:
         """
         Deletes all cookies and closes the browser session.
+        With fast_start the profile is kept as is for the next launch.
         """
-        logger.info("Clearing local and session storage.")
         try:
-            self.driver.execute_script("window.localStorage.clear();")
-            self.driver.execute_script("window.sessionStorage.clear();")
-        except Exception as e:
-            logger.error(f"Failed. {e}")
-        logger.info("Cleaning up cache files.")
-        self.driver.delete_all_cookies()
-        logger.info("Shutting down.")
-        self.driver.quit()
-        self.driver = None
-
-
-    def get_latest_download(self, checktime:int) -> None:
-        """
-        Get the last downloaded file name (from the script's download folder),
-        Loop check it until the download is complete, then return.
-        """
-        with self.lock:
-            logger.info(f"Looking for latest file in: {self.download_folder}")
-            print("This might take a while until the download is finished.")
-            while True:
-                # Get the list of files in the download folder
-                # Exclude .crdownload (still downloading) and temp files
-                files = [
-                    os.path.join(self.download_folder, f)
-                    for f in os.listdir(self.download_folder)
-                    if os.path.isfile(os.path.join(self.download_folder, f)) and f.endswith('.mp4')
-                ]
-
-                if not files:  # If the list is empty, skip to the next iteration
-                    logger.debug("No files found in Downloads folder.")
-                    time.sleep(checktime) # Wait before checking again
-                    continue
-
-                # Find the latest file based on creation time
-                latest_file = max(files, key=os.path.getctime)
-
-                file_creation_time = os.path.getctime(latest_file)
-                # Check if the file was downloaded this download function run
-                if self.lastdownload - file_creation_time <= 0:
-                    self.download_file_name = os.path.basename(latest_file)
-                    return
-                else:
-                    time.sleep(checktime)  # Wait before checking again
+            self.stop_ad_monitor()
+            if self.fast_start:
+                logger.info("Keeping the browser profile, shutting down.")
+                return
+            logger.info("Clearing local and session storage.")
+            try:
+                self.driver.execute_script("window.localStorage.clear();")
+                self.driver.execute_script("window.sessionStorage.clear();")
+            except Exception as e:
+                logger.error(f"Failed. {e}")
+            logger.info("Cleaning up cache files.")
+            self.driver.delete_all_cookies()
+            logger.info("Shutting down.")
+        finally:
+            # Even when the session is already broken, otherwise Chrome and chromedriver stay behind
+            try:
+                self.driver.quit()
+            finally:
+                self.driver = None
 
 
-    def download(self, link:str) -> None:
+    @tracing.traced("download")
+    def download(self, link:str, timeout:int=600) -> None:
         """
         Download video to this script/exe's folder using a site convertor,
         Then put it up in online-video-cutter for editing.
+        Gives up after timeout seconds, or when download_cancel is set.
         """
-        self.lastdownload = time.time()
+        self.download_cancel.clear()
+        # Before anything is clicked, so the file this download produces is the only new one
+        watcher = DownloadWatcher(self.download_folder)
         self.hide_window()
         with self.lock:
             self.driver.get("https://cnvmp3.com/")
@@ -349,6 +628,7 @@ class YouTubeAutomation:
         except TimeoutException:
             logger.error(f"Couldn't find search bar.")
             self.firstlink = True
+            watcher.close()
             return
         # Wait for the download button to appear
         try:
@@ -388,10 +668,17 @@ class YouTubeAutomation:
         self.driver.get("file://" + os.path.abspath("spinner.gif"))
         # fixme: find a way to defocus URL so it doesn't look hovered
         time.sleep(3)
-        # Scan for download finish
-        self.get_latest_download(0.2)
+        # Wait for the download to finish, without the lock so the rest of the automation keeps going
+        print("This might take a while until the download is finished.")
+        with watcher:
+            downloaded = watcher.wait(timeout, cancel=self.download_cancel)
         self.driver.close() # Close gif tab and return
         self.driver.switch_to.window(self.driver.window_handles[0])
+        if downloaded is None:
+            logger.error("Download didn't finish, not opening the editor.")
+            self.firstlink = True
+            return
+        self.download_file_name = os.path.basename(downloaded)
         logger.info("Opening editor.")
         self.show_window() 
         with self.lock:
@@ -410,12 +697,87 @@ class YouTubeAutomation:
         # Reset window hider in case the user starts opening links again.
         self.firstlink == True
 
-    def record(self, recordtime:int) -> None:
+    def get_record_region(self, region:str="video") -> dict:
+        """
+        Returns the on-screen box to record, in physical pixels.
+        region is "video" for just the player, "window" for the browser window or "screen" for the whole monitor.
+        Falls back to the browser window, then the whole monitor, if the smaller box can't be found.
+        """
+        if region == "video":
+            try:
+                # Convert the <video> rect from page CSS pixels to screen pixels
+                rect = self.driver.execute_script("""
+                    const video = document.querySelector('video');
+                    if (!video) return null;
+                    const r = video.getBoundingClientRect();
+                    const scale = window.devicePixelRatio;
+                    const border = (window.outerWidth - window.innerWidth) / 2;
+                    const toolbar = window.outerHeight - window.innerHeight - border;
+                    return {
+                        left: (window.screenX + border + r.left) * scale,
+                        top: (window.screenY + toolbar + r.top) * scale,
+                        width: r.width * scale,
+                        height: r.height * scale
+                    };
+                """)
+                if rect and rect["width"] > 0 and rect["height"] > 0:
+                    logger.info(f"Recording the video player: {rect}")
+                    return rect
+                logger.info("Video player not found, recording the browser window.")
+            except Exception as e:
+                logger.warning(f"Couldn't locate the video player: {e}")
+            region = "window"
+        if region == "window" and self.window is not None:
+            try:
+                rect = {"left": self.window.left, "top": self.window.top,
+                        "width": self.window.width, "height": self.window.height}
+                logger.info(f"Recording the browser window: {rect}")
+                return rect
+            except Exception as e:
+                logger.warning(f"Couldn't locate the browser window: {e}")
+        logger.info("Recording the whole monitor.")
+        return None
+
+    def record(self, recordtime:int, region:str="video", meter=None, stop_event:threading.Event=None,
+               levels:LevelAccumulator=None, finish_executor=None) -> str:
+        """
+        meter (a LiveLevelMeter) gets every audio chunk while recording, stop_event ends the recording early.
+        Returns the recording's file, or with finish_executor a Future of it: the encoding and the level
+        report then run on that executor and this returns as soon as the capture is done.
+        """
         if self.unavailable:
             logger.info("The video is unavailable, cancelling recording.")
+            return None
+        logger.info("Starting recording.")
+        # Levels are measured from the captured samples, no need to decode the recording again
+        levels = levels or LevelAccumulator()
+        output = record_screen(recordtime, region=self.get_record_region(region), levels=levels,
+                               audio_listeners=[meter.update] if meter else None, stop_event=stop_event,
+                               finish_executor=finish_executor)
+        if finish_executor is None:
+            self.report_live_levels(levels)
+            return output
+
+        def report(output_future):
+            # Runs on the executor once the file is done, the capture has moved on by then
+            if output_future.exception() is None:
+                self.report_live_levels(levels)
+        output.add_done_callback(report)
+        return output
+
+    @tracing.traced("measure_audio.report")
+    def report_live_levels(self, levels:LevelAccumulator) -> None:
+        # The loudness gating and the dB values are worked out here, the chunks were already taken in while recording
+        report_levels(*levels.levels(), levels.loudness.results())
+
+    def replay(self, seconds:int=30, region:str="video", hotkey:str="s") -> None:
+        """
+        Keeps the last seconds of the video in a replay buffer, hotkey saves them, Q stops.
+        """
+        if self.unavailable:
+            logger.info("The video is unavailable, not starting the replay buffer.")
         else:
-            logger.info("Starting recording.")
-            measure_audio(record_screen(recordtime))
+            replay_buffer(seconds, region=self.get_record_region(region), hotkey=hotkey)
 
     def full_auto(self, keyword:str, recordtime:int) -> None:
         """
@@ -424,7 +786,6 @@ class YouTubeAutomation:
         """
         self.initialize_driver()
         time.sleep(1)
-        self.youtube_search(keyword)
-        self.check_available()
+        self.play_keyword(keyword)
         self.record(recordtime)
         self.clean_up()
\ No newline at end of file
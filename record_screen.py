@@ -4,22 +4,48 @@ import time
 import cv2
 import os
 import threading
-import soundcard as sc
-import soundfile as sf
 import subprocess
+import shutil
 from concurrent.futures import ThreadPoolExecutor
 import warnings
 from log import logger
 import keyboard
+import tracing
 from audio_measure import *
+from encoder import FFmpegWriter, SegmentEncoder, mux_audio, write_frame_list
+from capture import FrameScheduler, ChangeDetector, QualityController, frame_view
+from shm_pipeline import SharedMemoryPipeline, PipelineError
+from audio_recorder import LoopbackRecorder
 
 
-def record_screen(record_time:int) -> str:
+def record_screen(record_time:int, streaming:bool=True, fps:int=30, region:dict=None, processes:bool=False,
+                  levels:LevelAccumulator=None, audio_listeners:list=None, stop_event:threading.Event=None,
+                  segment_seconds:int=None, container:str="mp4", adaptive:bool=False, finish_executor=None) -> str:
+    """
+    Records the screen and the speaker loopback for record_time seconds (or until Q is pressed).
+    With streaming on, frames are piped straight into ffmpeg while recording,
+    otherwise they're kept in memory and written out as PNGs afterwards.
+    Frames are captured at a constant fps, duplicated/dropped as needed to keep A/V sync.
+    Frames that didn't change since the last one reuse the previous frame (except when streaming,
+    where ffmpeg gets every frame anyway and there's nothing to save).
+    region is an mss style box (left, top, width, height) to record instead of the whole primary monitor.
+    processes moves the conversion and encoding into worker processes fed through shared memory (implies streaming).
+    levels gets every audio chunk while recording, so the dB values are ready as soon as it stops.
+    audio_listeners are extra callables that get every audio chunk (e.g. a live level meter).
+    stop_event ends the recording early when set, same as pressing Q.
+    segment_seconds cuts the capture into segments that get encoded in parallel while recording
+    (instead of streaming or encoding all the PNGs at the end).
+    container "fmp4" or "hls" makes the streamed video crash safe: it's playable up to the last fragment
+    while recording, and together with the audio file (written as it comes) can be muxed after a crash.
+    adaptive lowers the capture fps (and the resolution, with segments) while the recorder can't keep up.
+    finish_executor (e.g. a ThreadPoolExecutor) runs the encoding/muxing after the capture,
+    a Future of the output file is returned instead of the file.
+    """
     # Prevent audio recorder warning spam
     warnings.filterwarnings("ignore")
 
-    # Prepare the hotkey stopping event
-    stop_recording = threading.Event() 
+    # Prepare the hotkey stopping event (the caller can pass one in to stop it themselves)
+    stop_recording = stop_event or threading.Event()
 
     output_folder = "Recordings"
     # Create the output folder if it doesn't exist
@@ -29,130 +55,270 @@ def record_screen(record_time:int) -> str:
     # Setup for screen capture
     sct = mss.mss()
 
-    # Get screen details
+    # Get screen details, either the requested box or the whole primary monitor
     screen = sct.monitors[1]
+    if region:
+        screen = fit_region(region, sct.monitors[0]) or screen
+    logger.info(f"Capture area: {screen['width']}x{screen['height']} at ({screen['left']}, {screen['top']})")
 
-    # Store frames
+    # Store frames (only used when not streaming)
     frames = []
 
-    # Stop recording by pressing Q
-    def stop_recording_listener():
+    # Stop recording by pressing Q, the hotkey is removed again once the capture ends
+    def stop_recording_hotkey():
         logger.info("Q pressed, stopping recording.")
-        keyboard.wait('q')
         # Set event to stop recording
         stop_recording.set()
 
-    threading.Thread(target=stop_recording_listener, daemon=True).start()
+    stop_hotkey = keyboard.add_hotkey('q', stop_recording_hotkey)
 
+    start_time = time.time()
+    current_time_str = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(start_time))
+    output_video_file = os.path.join(output_folder, f"Recording_{current_time_str}.mp4")
 
-    # Record audio 
-    # Not recommended to change these
-    # I spent a while finding the one that glitches the least with this library
-    def record_audio(output_file=os.path.join(output_folder, "out.mp3"), record_sec=record_time, sample_rate=44100, chunk_duration=1):
-        data = []
-        with sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(samplerate=sample_rate) as mic:
-            for _ in range(int(record_sec // chunk_duration)):
-                if stop_recording.is_set():
-                    break
-                chunk = mic.record(numframes=sample_rate * chunk_duration)
-                data.append(chunk[:, 0])
-                if stop_recording.is_set():
-                    break
-        full_data = np.concatenate(data, axis=0)
-        sf.write(file=output_file, data=full_data, samplerate=sample_rate)
-
-    # Set up audio recording in a separate thread
-    audio_thread = threading.Thread(target=record_audio, args=(os.path.join(output_folder, "out.mp3"), record_time))
+    # Record audio in a separate thread, chunks go straight to disk
+    audio_file = os.path.join(output_folder, f"audio_{current_time_str}.flac")
+    audio_recorder = LoopbackRecorder(audio_file, stop_recording, record_time)
+    if levels:
+        audio_recorder.listeners.append(levels.update)
+    audio_recorder.listeners.extend(audio_listeners or [])
+    audio_thread = threading.Thread(target=audio_recorder.run)
 
     # Start video recording
-    start_time = time.time()
     logger.info(f"Recording for {record_time} seconds...")
 
+    # In streaming mode ffmpeg encodes while we capture, so only one frame is held at a time
+    streaming = (streaming or processes) and not segment_seconds
+    pipeline = None
+    writer = None
+    video_only_file = os.path.join(output_folder, f"video_{current_time_str}.mp4")
+    if container == "hls" and not segment_seconds:
+        # The playlist and its segments get their own folder
+        os.makedirs(os.path.join(output_folder, f"video_{current_time_str}"), exist_ok=True)
+        video_only_file = os.path.join(output_folder, f"video_{current_time_str}", "video.m3u8")
+    if processes:
+        pipeline = SharedMemoryPipeline(video_only_file, screen["width"], screen["height"], fps, container=container)
+    elif segment_seconds:
+        writer = SegmentEncoder(video_only_file, os.path.join(output_folder, f"segments_{current_time_str}"), fps, segment_seconds)
+        write_frame = writer.write
+    elif streaming:
+        # ffmpeg takes the BGRA grab as is and does the pixel format conversion itself
+        writer = FFmpegWriter(video_only_file, screen["width"], screen["height"], fps, pix_fmt="bgra", container=container)
+        write_frame = writer.write
+    else:
+        write_frame = frames.append
+
+    # Grab at a fixed rate instead of as fast as mss allows, stalls get evened out with duplicates
+    scheduler = FrameScheduler(fps)
+    # Static screens (paused player, end screen) just repeat the last frame instead of storing a new one
+    detector = ChangeDetector()
+    last_frame = None
+    controller = QualityController(scheduler.interval) if adaptive else None
+    # Per-frame timings only when tracing, the span also records what ended the capture if it raised
+    tracer = tracing.active()
+    capture_span = tracing.span("capture", fps=fps, width=screen["width"], height=screen["height"])
     audio_thread.start()
+    scheduler.start()
     try:
-        while time.time() - start_time < record_time:
-            if stop_recording.is_set():
-                break
+        with capture_span:
+            while scheduler.elapsed() < record_time:
+                if stop_recording.is_set():
+                    break
+                scheduler.wait()
+                if pipeline:
+                    slot = pipeline.acquire()
+                    if slot is None:
+                        # Workers are behind, skip this grab instead of waiting on them, the next frame fills the gap
+                        time.sleep(scheduler.interval)
+                        continue
+
+                # Capture frame, a view over the raw BGRA bytes so nothing gets copied
+                timestamp = scheduler.elapsed()
+                img = sct.grab(screen)
+                frame = frame_view(img)
+                if pipeline:
+                    # The worker does the conversion, just copy the raw grab into shared memory
+                    if detector.changed(frame):
+                        np.copyto(pipeline.frame(slot), frame)
+                    else:
+                        pipeline.release(slot)
+                        slot = None
+                    pipeline.submit(slot, scheduler.place(timestamp))
+                else:
+                    # Keeping the view keeps the screenshot buffer alive, no extra copy needed when streaming.
+                    # The constant fps stream gets every frame written regardless, so comparing them would only cost time.
+                    # Frames kept in memory get converted to BGR, it's a quarter smaller than BGRA
+                    if streaming:
+                        last_frame = frame
+                    elif detector.changed(frame):
+                        last_frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
 
-            # Capture frame and convert it from BGRA to BGR for higher color accuracy 
-            img = sct.grab(screen)
-            frame = np.array(img)
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+                    # Hand the frame to the encoder (or save it to the list for later ffmpeg processing)
+                    for _ in range(scheduler.place(timestamp)):
+                        write_frame(last_frame)
 
-            # Save the frame to list (later for ffmpeg processing)
-            frames.append(frame)
+                if tracer:
+                    tracer.observe("capture.frame", scheduler.elapsed() - timestamp)
+                # Step the quality down/up depending on how long this frame took and what's queued up
+                if controller:
+                    controller.observe(scheduler.elapsed() - timestamp)
+                    encoder = pipeline or writer
+                    if controller.update(encoder.backlog() if encoder else 0):
+                        scheduler.stride = controller.stride
+                        if segment_seconds:
+                            writer.scale = controller.scale
 
     except KeyboardInterrupt:
         logger.info("Recording interrupted by user.")
+    except BrokenPipeError:
+        logger.error("Streaming encoder stopped unexpectedly, ending capture.")
+        stop_recording.set()
+    except PipelineError as e:
+        # The workers are already stopped, let the audio thread end too before giving up
+        logger.error(f"{e}, ending capture.")
+        stop_recording.set()
+        audio_thread.join()
+        raise
+    finally:
+        keyboard.remove_hotkey(stop_hotkey)
+        tracing.count("capture.frames", scheduler.grabbed)
+        tracing.count("capture.duplicated", scheduler.duplicated)
+        tracing.count("capture.dropped", scheduler.dropped)
+        tracing.count("capture.unchanged", detector.unchanged)
 
     # Wait for audio thread to finish
     audio_thread.join()
 
-    # Calculate the FPS based on frames captured and the actual duration
-    # This avoids the video speeding up/slowing down based on pre-set fps and hardware limits
+    # The output runs at a constant fps, so report how much the scheduler had to patch up
     elapsed_time = time.time() - start_time
-    fps = len(frames) / elapsed_time
-    logger.info(f"Actual FPS during recording: {fps:.2f}")
+    scheduler.log_stats()
+    logger.info(f"Unchanged frames reused: {detector.unchanged}")
     logger.info(f"Time since recording started: {elapsed_time}")
-    logger.info("Starting video processing...")
-
-    # Save frames to disk in the specific folder
-    frames_dir = os.path.join(output_folder, "frames")
-    if not os.path.exists(frames_dir):
-        os.makedirs(frames_dir)
-    logger.info("Created temp directory to save frames to.")
-
-    # Optimized frame saving process using ThreadPoolExecutor
-    # This sped up the processing time by 3x
-    def save_frame(i, frame, frames_dir):
-        frame_path = os.path.join(frames_dir, f"frame_{i:04d}.png")
-        cv2.imwrite(frame_path, frame)
-
-    # Use ThreadPoolExecutor to save frames concurrently
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for i, frame in enumerate(frames):
-            futures.append(executor.submit(save_frame, i, frame, frames_dir))
-        # Wait for all threads to complete
-        for future in futures:
-            future.result()
-
-    # Assemble video from frames using ffmpeg
-    current_time_str = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(start_time))
-    output_video_file = os.path.join(output_folder, f"Recording_{current_time_str}.mp4")
-    logger.info("Saved video as: Recording_{current_time_str}.mp4")
-    logger.info("Assembling video with ffmpeg...")
-
-    # Use ffmpeg to combine video and audio into one file
-    #fixme: add to project file so it doesn't require an add to path and user install
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-framerate", str(fps),                    
-        "-i", f"{frames_dir}/frame_%04d.png",      # Frame file path pattern
-        "-i", os.path.join(output_folder, "out.mp3"),
-        "-t", str(record_time),                # Ensure exact video duration
-        "-vf", "setpts=PTS-STARTPTS",              # Accurate playback timing
-        "-r", str(fps),                            # Set output video frame rate
-        "-c:v", "libx264",                         # Video codec
-        "-pix_fmt", "yuv420p",                     # Pixel format for compatibility
-        "-c:a", "aac",                             # Audio codec
-        "-shortest",                               # Match video length to shortest input
-        output_video_file
-    ]
-
-    # Run ffmpeg command
-    subprocess.run(ffmpeg_cmd)
-
-    # Clean up temporary frame files
-    for file in os.listdir(frames_dir):
-        os.remove(os.path.join(frames_dir, file))
-    os.rmdir(frames_dir)
 
+    # Line the audio up with the first video frame using the chunk timestamps
+    audio_offset = audio_recorder.offset_from(scheduler.start_time)
+    logger.info(f"Audio starts {audio_offset:.3f}s after the video.")
+
+    def finish() -> str:
+        """
+        Everything after the capture: flushing/encoding the video and adding the audio.
+        """
+        if pipeline or writer:
+            # Let ffmpeg flush the last frames, then copy the video next to the audio
+            if pipeline:
+                pipeline.close()
+            else:
+                writer.close()
+            logger.info("Adding audio to the streamed video...")
+            mux_audio(video_only_file, audio_file, output_video_file, audio_offset)
+            if container == "hls" and not segment_seconds:
+                shutil.rmtree(os.path.dirname(video_only_file), ignore_errors=True)
+            elif os.path.exists(video_only_file):
+                os.remove(video_only_file)
+            return finish_recording(audio_file, output_video_file, start_time)
+
+        logger.info("Starting video processing...")
+
+        # Save frames to disk in the specific folder
+        frames_dir = os.path.join(output_folder, f"frames_{current_time_str}")  # Unique, finishes can overlap
+        if not os.path.exists(frames_dir):
+            os.makedirs(frames_dir)
+        logger.info("Created temp directory to save frames to.")
+
+        # Optimized frame saving process using ThreadPoolExecutor
+        # This sped up the processing time by 3x
+        def save_frame(i, frame, frames_dir):
+            frame_path = os.path.join(frames_dir, f"frame_{i:04d}.png")
+            cv2.imwrite(frame_path, frame)
+
+        # Repeated frames are the same object in the list, collapse them into runs
+        # so every distinct frame is only written once
+        runs = []
+        for frame in frames:
+            if runs and runs[-1][0] is frame:
+                runs[-1][1] += 1
+            else:
+                runs.append([frame, 1])
+        logger.info(f"Writing {len(runs)} distinct frames out of {len(frames)}.")
+
+        # Use ThreadPoolExecutor to save frames concurrently
+        with tracing.span("frames.save", frames=len(runs)), ThreadPoolExecutor(max_workers=4) as executor:
+            futures = []
+            for i, (frame, _) in enumerate(runs):
+                futures.append(executor.submit(save_frame, i, frame, frames_dir))
+            # Wait for all threads to complete
+            for future in futures:
+                future.result()
+
+        # Tell ffmpeg how long each distinct frame stays on screen
+        concat_list = write_frame_list(
+            os.path.join(frames_dir, "frames.txt"),
+            [(f"frame_{i:04d}.png", count) for i, (_, count) in enumerate(runs)],
+            fps
+        )
+
+        # Assemble video from frames using ffmpeg
+        logger.info(f"Saved video as: Recording_{current_time_str}.mp4")
+        logger.info("Assembling video with ffmpeg...")
+
+        # Use ffmpeg to combine video and audio into one file
+        #fixme: add to project file so it doesn't require an add to path and user install
+        ffmpeg_cmd = [
+            "ffmpeg",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", concat_list,                         # Distinct frames with their durations
+            "-itsoffset", str(audio_offset),           # Line the audio up with the first frame
+            "-i", audio_file,
+            "-t", str(record_time),                # Ensure exact video duration
+            "-vf", "setpts=PTS-STARTPTS",              # Accurate playback timing
+            "-r", str(fps),                            # Set output video frame rate
+            "-c:v", "libx264",                         # Video codec
+            "-pix_fmt", "yuv420p",                     # Pixel format for compatibility
+            "-c:a", "aac",                             # Audio codec
+            "-shortest",                               # Match video length to shortest input
+            output_video_file
+        ]
+
+        # Run ffmpeg command
+        with tracing.span("ffmpeg.encode"):
+            subprocess.run(ffmpeg_cmd)
+
+        # Clean up temporary frame files
+        for file in os.listdir(frames_dir):
+            os.remove(os.path.join(frames_dir, file))
+        os.rmdir(frames_dir)
+
+        return finish_recording(audio_file, output_video_file, start_time)
+
+    if finish_executor is not None:
+        # Let the caller move on (e.g. to the next recording) while this finishes in the background
+        return finish_executor.submit(finish)
+    return finish()
+
+
+def fit_region(region:dict, bounds:dict) -> dict:
+    """
+    Clamps the region to the virtual screen (all monitors) and rounds the size down to even numbers,
+    libx264 with yuv420p refuses odd dimensions.
+    """
+    left = max(int(region["left"]), bounds["left"])
+    top = max(int(region["top"]), bounds["top"])
+    right = min(int(region["left"] + region["width"]), bounds["left"] + bounds["width"])
+    bottom = min(int(region["top"] + region["height"]), bounds["top"] + bounds["height"])
+    width = (right - left) // 2 * 2
+    height = (bottom - top) // 2 * 2
+    if width <= 0 or height <= 0:
+        logger.warning(f"Capture region {region} is off screen, recording the primary monitor.")
+        return None
+    return {"left": left, "top": top, "width": width, "height": height}
+
+
+def finish_recording(audio_file:str, output_video_file:str, start_time:float) -> str:
     # Delete the audio file once the process is complete
-    audio_file_path = os.path.join(output_folder, "out.mp3")
-    if os.path.exists(audio_file_path):
-        os.remove(audio_file_path)
-        logger.info(f"Deleted audio file: {audio_file_path}")
+    if os.path.exists(audio_file):
+        os.remove(audio_file)
+        logger.info(f"Deleted audio file: {audio_file}")
 
     logger.info(f"Recording saved as {output_video_file}")
     logger.info(f"Total process time: {time.time()-start_time}")
@@ -0,0 +1,165 @@
+import os
+import time
+import threading
+import warnings
+from collections import deque
+import cv2
+import mss
+import numpy as np
+import keyboard
+import soundfile as sf
+from log import logger
+from capture import FrameScheduler, ChangeDetector, frame_view
+from audio_recorder import LoopbackRecorder
+from encoder import encode_jpegs, mux_audio
+from record_screen import fit_region
+
+
+class AudioRing:
+    """
+    Preallocated ring of the last N seconds of loopback audio, fed as an audio listener.
+    """
+    def __init__(self, seconds:int, sample_rate:int=44100) -> None:
+        self.sample_rate = sample_rate
+        self.buffer = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+        self.position = 0
+        self.filled = 0
+        self.end_time = None  # perf_counter time of the newest sample
+        self.lock = threading.Lock()  # Snapshots come from the hotkey thread
+
+    def update(self, samples) -> None:
+        samples = np.asarray(samples, dtype=np.float32)[-len(self.buffer):]
+        size = len(self.buffer)
+        with self.lock:
+            first = min(len(samples), size - self.position)
+            self.buffer[self.position:self.position + first] = samples[:first]
+            self.buffer[:len(samples) - first] = samples[first:]
+            self.position = (self.position + len(samples)) % size
+            self.filled = min(self.filled + len(samples), size)
+            self.end_time = time.perf_counter()
+
+    def snapshot(self) -> tuple:
+        """
+        Returns the buffered audio in order and the perf_counter time of its first sample.
+        """
+        with self.lock:
+            audio = np.roll(self.buffer, -self.position)[len(self.buffer) - self.filled:]
+            start = self.end_time - self.filled / self.sample_rate if self.end_time else None
+        return audio, start
+
+
+class ReplayBuffer:
+    """
+    Keeps the last N seconds of video as JPEGs (one per output frame slot, repeats share the same bytes)
+    and the matching audio, so memory stays constant however long it runs.
+    save() writes an MP4 on a background thread while the capture keeps going.
+    """
+    def __init__(self, seconds:int=30, fps:int=30, output_folder:str="Recordings", quality:int=85) -> None:
+        self.seconds = seconds
+        self.fps = fps
+        self.output_folder = output_folder
+        self.quality = quality
+        self.frames = deque(maxlen=seconds * fps)  # (slot time, jpeg)
+        self.audio = AudioRing(seconds)
+        self.saves = []
+
+    def add(self, slot_time:float, jpeg) -> None:
+        # deque append is atomic, the hotkey thread can copy it at any time
+        self.frames.append((slot_time, jpeg))
+
+    def save(self) -> None:
+        """
+        Hotkey callback. Snapshots the buffer (references only) and hands the writing to a thread.
+        """
+        # A double press or key auto-repeat fires again straight away, one save at a time is plenty
+        if self.saves and self.saves[-1].is_alive():
+            logger.info("Still saving the previous replay, ignoring the hotkey.")
+            return
+        frames = list(self.frames)
+        audio, audio_start = self.audio.snapshot()
+        if not frames:
+            logger.info("Replay buffer is empty, nothing to save.")
+            return
+        logger.info(f"Saving the last {len(frames) / self.fps:.1f}s of replay.")
+        thread = threading.Thread(target=self.write, args=(frames, audio, audio_start, len(self.saves) + 1))
+        thread.start()
+        self.saves.append(thread)
+
+    def write(self, frames:list, audio, audio_start:float, number:int) -> str:
+        # The save number keeps two saves within the same second from sharing file names
+        current_time_str = f"{time.strftime('%Y-%m-%d_%H-%M-%S')}_{number}"
+        video_file = os.path.join(self.output_folder, f"replay_video_{current_time_str}.mp4")
+        audio_file = os.path.join(self.output_folder, f"replay_audio_{current_time_str}.flac")
+        output_file = os.path.join(self.output_folder, f"Replay_{current_time_str}.mp4")
+        encode_jpegs([jpeg for _, jpeg in frames], self.fps, video_file)
+        if audio.size and audio_start is not None:
+            sf.write(audio_file, audio, self.audio.sample_rate)
+            mux_audio(video_file, audio_file, output_file, audio_start - frames[0][0])
+            os.remove(audio_file)
+            os.remove(video_file)
+        else:
+            os.replace(video_file, output_file)
+        logger.info(f"Replay saved as {output_file}")
+        return output_file
+
+
+def replay_buffer(seconds:int=30, fps:int=30, region:dict=None, hotkey:str="s", stop_event:threading.Event=None) -> None:
+    """
+    Captures continuously and keeps the last seconds of video/audio in memory.
+    Press hotkey to save them as an MP4, Q to stop.
+    """
+    # Prevent audio recorder warning spam
+    warnings.filterwarnings("ignore")
+    stop_recording = stop_event or threading.Event()
+    output_folder = "Recordings"
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    sct = mss.mss()
+    screen = sct.monitors[1]
+    if region:
+        screen = fit_region(region, sct.monitors[0]) or screen
+
+    buffer = ReplayBuffer(seconds, fps, output_folder)
+
+    # Stop recording by pressing Q, same hotkey as record_screen
+    def stop_recording_hotkey():
+        logger.info("Q pressed, stopping replay buffer.")
+        stop_recording.set()
+
+    stop_hotkey = keyboard.add_hotkey('q', stop_recording_hotkey)
+    save_hotkey = keyboard.add_hotkey(hotkey, buffer.save)
+
+    audio_recorder = LoopbackRecorder(None, stop_recording, None)
+    audio_recorder.listeners.append(buffer.audio.update)
+    audio_thread = threading.Thread(target=audio_recorder.run)
+    audio_thread.start()
+
+    logger.info(f"Replay buffer running ({seconds}s), press {hotkey} to save, q to stop.")
+    # Runs until Q, so no per-grab timestamp list that would grow for as long as it runs
+    scheduler = FrameScheduler(fps, keep_timestamps=False)
+    detector = ChangeDetector()
+    jpeg = None
+    scheduler.start()
+    try:
+        while not stop_recording.is_set():
+            scheduler.wait()
+            timestamp = scheduler.elapsed()
+            frame = frame_view(sct.grab(screen))
+            # Only changed frames get compressed again, repeats share the last JPEG
+            if detector.changed(frame):
+                _, jpeg = cv2.imencode(".jpg", cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR), [cv2.IMWRITE_JPEG_QUALITY, buffer.quality])
+            count = scheduler.place(timestamp)
+            for slot in range(scheduler.emitted - count, scheduler.emitted):
+                buffer.add(scheduler.start_time + slot * scheduler.interval, jpeg)
+    except KeyboardInterrupt:
+        logger.info("Replay buffer interrupted by user.")
+        stop_recording.set()
+
+    keyboard.remove_hotkey(save_hotkey)
+    keyboard.remove_hotkey(stop_hotkey)
+    audio_thread.join()
+    # Let any save that's still writing finish
+    for thread in buffer.saves:
+        thread.join()
+    scheduler.log_stats()
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from log import logger
+
+
+def normalize_keyword(keyword:str) -> str:
+    # "Floating  Darkness tatsh" and "floating darkness Tatsh" are the same search
+    return " ".join(keyword.lower().split())
+
+
+def video_id(url:str) -> str:
+    """
+    The v= id of a watch link, None for anything else.
+    """
+    return parse_qs(urlparse(url).query).get("v", [None])[0]
+
+
+class SearchCache:
+    """
+    Remembers which video a keyword search ended up on, so repeated searches can skip the browser search.
+    Least recently used entries are dropped past max_entries, entries older than ttl (seconds) are ignored,
+    and everything is written to cache_file so it survives restarts.
+    """
+    def __init__(self, cache_file:str="search_cache.json", max_entries:int=500, ttl:float=7 * 24 * 3600) -> None:
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # keyword -> {"url": ..., "time": ...}, oldest use first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # A browser pool can share one cache
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.cache_file) as file:
+                self.entries.update(json.load(file))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read the search cache, starting empty: {e}")
+
+    def save(self) -> None:
+        # Write then swap, a crash mid-write can't leave a broken cache behind
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(temp_file, self.cache_file)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, keyword:str) -> str:
+        """
+        The cached link for keyword, or None on a miss.
+        """
+        key = normalize_keyword(keyword)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["time"] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        logger.info(f"Search cache {'hit' if entry else 'miss'} for '{key}' (hit rate {self.hit_rate:.0%}, "
+                    f"{self.hits}/{self.hits + self.misses}).")
+        return entry["url"] if entry else None
+
+    def put(self, keyword:str, url:str) -> None:
+        vid = video_id(url)
+        if vid:
+            # Drop tracking parameters, the id is all that's needed
+            url = f"https://www.youtube.com/watch?v={vid}"
+        key = normalize_keyword(keyword)
+        with self.lock:
+            self.entries[key] = {"url": url, "time": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def invalidate(self, url:str) -> None:
+        """
+        Forgets every keyword that resolved to this video, e.g. once it got deleted or made private.
+        """
+        vid = video_id(url)
+        if not vid:
+            return
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if video_id(entry["url"]) == vid]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self.save()
+                logger.info(f"Removed unavailable video {vid} from the search cache ({', '.join(stale)}).")
@@ -0,0 +1,238 @@
+import cv2
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from queue import Empty
+from log import logger, worker_queue, init_worker
+from encoder import FFmpegWriter
+
+# Sent down the queues to shut the workers down
+STOP = None
+# How long a worker waits on a queue before checking whether the other side is still there
+POLL_TIMEOUT = 1.0
+JOIN_TIMEOUT = 30.0
+
+
+class PipelineError(RuntimeError):
+    """
+    A worker process died, the recording can't continue.
+    """
+
+
+class FrameRing:
+    """
+    A fixed number of frame slots in one shared memory block.
+    Processes only pass slot numbers around, so the pixels are never pickled or copied between them.
+    """
+    def __init__(self, slots:int, shape:tuple, name:str=None) -> None:
+        self.slots = slots
+        self.shape = shape
+        size = slots * int(np.prod(shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((slots, *shape), dtype=np.uint8, buffer=self.shm.buf)
+
+    def info(self) -> tuple:
+        """
+        What another process needs to attach to the same ring.
+        """
+        return (self.slots, self.shape, self.shm.name)
+
+    def close(self, unlink:bool=False) -> None:
+        # The numpy view has to go before the buffer can be released
+        del self.frames
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def convert_worker(bgra_info:tuple, bgr_info:tuple, ready_bgra, free_bgra, ready_bgr, free_bgr, encoder_exited, log_queue) -> None:
+    """
+    Converts captured BGRA slots into BGR slots for the encoder.
+    Blocks on the encoder when it's behind, which is fine since capture never waits on us.
+    Gives up once the encoder is gone, nothing would ever free a BGR slot again.
+    """
+    init_worker(log_queue)
+    bgra = FrameRing(*bgra_info)
+    bgr = FrameRing(*bgr_info)
+    while True:
+        job = ready_bgra.get()
+        if job is STOP:
+            ready_bgr.put(STOP)
+            break
+        slot, count = job
+        if slot is None:
+            # Unchanged frame, the encoder repeats the last one
+            ready_bgr.put((None, count))
+            continue
+        out = None
+        while out is None and not encoder_exited.is_set():
+            try:
+                out = free_bgr.get(timeout=POLL_TIMEOUT)
+            except Empty:
+                pass
+        if out is None:
+            logger.error("Encoder process exited, stopping the converter.")
+            break
+        cv2.cvtColor(bgra.frames[slot], cv2.COLOR_BGRA2BGR, dst=bgr.frames[out])
+        free_bgra.put(slot)
+        ready_bgr.put((out, count))
+    bgra.close()
+    bgr.close()
+
+
+def encode_worker(bgr_info:tuple, output_file:str, fps:int, container:str, ready_bgr, free_bgr, exited, log_queue) -> None:
+    """
+    Feeds converted slots to a streaming ffmpeg process.
+    Holds on to the last slot so unchanged frames can be repeated without a copy.
+    exited gets set however this ends, so the converter doesn't wait on us forever.
+    """
+    init_worker(log_queue)
+    try:
+        encode_frames(bgr_info, output_file, fps, container, ready_bgr, free_bgr)
+    finally:
+        exited.set()
+
+
+def encode_frames(bgr_info:tuple, output_file:str, fps:int, container:str, ready_bgr, free_bgr) -> None:
+    bgr = FrameRing(*bgr_info)
+    height, width, _ = bgr.shape
+    writer = FFmpegWriter(output_file, width, height, fps, container=container)
+    last = None
+    failed = False
+    while True:
+        job = ready_bgr.get()
+        if job is STOP:
+            break
+        slot, count = job
+        if slot is not None:
+            if last is not None:
+                free_bgr.put(last)
+            last = slot
+        if last is None or failed:
+            continue
+        try:
+            for _ in range(count):
+                writer.write(bgr.frames[last])
+        except BrokenPipeError:
+            # Keep draining the queue so the other processes don't hang on full rings
+            logger.error("Streaming encoder stopped unexpectedly, discarding the remaining frames.")
+            failed = True
+    writer.close()
+    bgr.close()
+
+
+class SharedMemoryPipeline:
+    """
+    Runs the BGRA->BGR conversion and the encoding in their own processes,
+    connected to the capture loop through shared memory frame rings.
+    Capture never blocks: when no slot is free the frame is skipped and counted.
+    """
+    def __init__(self, output_file:str, width:int, height:int, fps:int, slots:int=8, container:str="mp4") -> None:
+        self.slots = slots
+        self.bgra = FrameRing(slots, (height, width, 4))
+        # One extra slot for the frame the encoder holds on to
+        self.bgr = FrameRing(slots + 1, (height, width, 3))
+        self.ready_bgra = mp.Queue()
+        self.free_bgra = mp.Queue()
+        self.ready_bgr = mp.Queue()
+        self.free_bgr = mp.Queue()
+        self.encoder_exited = mp.Event()
+        for i in range(self.bgra.slots):
+            self.free_bgra.put(i)
+        for i in range(self.bgr.slots):
+            self.free_bgr.put(i)
+
+        # Stats
+        self.submitted = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self.total_depth = 0
+
+        self.converter = mp.Process(
+            target=convert_worker,
+            name="converter",
+            args=(self.bgra.info(), self.bgr.info(), self.ready_bgra, self.free_bgra, self.ready_bgr, self.free_bgr,
+                  self.encoder_exited, worker_queue()),
+            daemon=True
+        )
+        self.encoder = mp.Process(
+            target=encode_worker,
+            name="encoder",
+            args=(self.bgr.info(), output_file, fps, container, self.ready_bgr, self.free_bgr, self.encoder_exited,
+                  worker_queue()),
+            daemon=True
+        )
+        self.converter.start()
+        self.encoder.start()
+        logger.info(f"Started shared memory pipeline with {slots} slots ({width}x{height}).")
+
+    def acquire(self) -> int:
+        """
+        Returns a free capture slot, or None if the workers are behind and the frame should be skipped.
+        """
+        try:
+            slot = self.free_bgra.get_nowait()
+        except Empty:
+            # Out of slots is normal when the workers are busy, but not when one of them is gone
+            self.check_workers()
+            self.skipped += 1
+            return None
+        depth = self.slots - self.free_bgra.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        return slot
+
+    def check_workers(self) -> None:
+        """
+        Raises PipelineError (after stopping the other worker) if a worker process died.
+        """
+        dead = [process.name for process in (self.converter, self.encoder) if not process.is_alive()]
+        if dead:
+            self.terminate()
+            self.bgra.close(unlink=True)
+            self.bgr.close(unlink=True)
+            raise PipelineError(f"Pipeline worker exited unexpectedly: {', '.join(dead)}")
+
+    def terminate(self) -> None:
+        for process in (self.converter, self.encoder):
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    def backlog(self) -> int:
+        return self.slots - self.free_bgra.qsize()
+
+    def frame(self, slot:int):
+        return self.bgra.frames[slot]
+
+    def release(self, slot:int) -> None:
+        self.free_bgra.put(slot)
+
+    def submit(self, slot:int, count:int) -> None:
+        """
+        Queues a filled slot to be written count times, None repeats the previous frame.
+        """
+        self.ready_bgra.put((slot, count))
+        self.submitted += 1
+
+    def close(self) -> None:
+        """
+        Lets the workers finish the queued frames, then frees the shared memory.
+        Raises PipelineError if a worker died or didn't finish in time.
+        """
+        self.ready_bgra.put(STOP)
+        self.converter.join(JOIN_TIMEOUT)
+        self.encoder.join(JOIN_TIMEOUT)
+        failed = [process.name for process in (self.converter, self.encoder)
+                  if process.is_alive() or process.exitcode != 0]
+        self.terminate()
+        self.bgra.close(unlink=True)
+        self.bgr.close(unlink=True)
+        average_depth = self.total_depth / self.submitted if self.submitted else 0
+        logger.info(f"Pipeline frames submitted: {self.submitted}, skipped (workers behind): {self.skipped}")
+        logger.info(f"Pipeline queue depth: max {self.max_depth}/{self.slots}, average {average_depth:.1f}")
+        if failed:
+            raise PipelineError(f"Pipeline worker failed: {', '.join(failed)}")
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+import multiprocessing
+from log import logger
+
+# Named tracing instead of trace so it doesn't shadow the standard library module.
+# Off unless APP_TRACE is set (to 1 or a file name) or enable() is called. While it's off span() hands out
+# the same do-nothing object, count()/observe() return straight away and hot loops check active() once.
+
+
+class Tracer:
+    """
+    Collects how long each stage took and a few counters, writes every span to a JSONL file
+    and sums it all up (count, total, percentiles) at the end of the run.
+    """
+    def __init__(self, trace_file:str="trace.jsonl") -> None:
+        self.trace_file = trace_file
+        self.durations = {}  # Stage name -> every duration seen, in seconds
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.file = open(trace_file, "a", encoding="utf-8", buffering=1)
+        self.write({"type": "run", "pid": os.getpid(), "time": time.time()})
+
+    def write(self, event:dict) -> None:
+        with self.lock:
+            self.file.write(json.dumps(event) + "\n")
+
+    def observe(self, name:str, seconds:float) -> None:
+        """
+        Adds a duration to the stats without writing a trace line, for things that happen every frame.
+        """
+        with self.lock:
+            self.durations.setdefault(name, []).append(seconds)
+
+    def count(self, name:str, value:int=1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def span_done(self, name:str, start:float, seconds:float, fields:dict) -> None:
+        self.observe(name, seconds)
+        self.write({"type": "span", "name": name, "start": start, "duration": seconds,
+                    "thread": threading.current_thread().name, **fields})
+
+    def summary(self) -> dict:
+        with self.lock:
+            stages = {}
+            for name, samples in self.durations.items():
+                samples = sorted(samples)
+                stages[name] = {
+                    "count": len(samples),
+                    "total": sum(samples),
+                    "mean": sum(samples) / len(samples),
+                    "p50": percentile(samples, 50),
+                    "p95": percentile(samples, 95),
+                    "p99": percentile(samples, 99),
+                    "max": samples[-1],
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def close(self) -> None:
+        summary = self.summary()
+        self.write({"type": "summary", **summary})
+        self.file.close()
+        print(format_summary(summary))
+        logger.info(f"Trace written to {self.trace_file}")
+
+
+class Span:
+    """
+    Times a with block (or a decorated function) and reports it to the tracer.
+    """
+    __slots__ = ("tracer", "name", "fields", "start", "wall_start")
+
+    def __init__(self, tracer:Tracer, name:str, fields:dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.tracer.span_done(self.name, self.wall_start, seconds, self.fields)
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NO_SPAN = NoSpan()
+_tracer = None
+
+
+def percentile(sorted_samples:list, percent:float) -> float:
+    # Nearest rank, good enough for a summary
+    index = max(0, min(len(sorted_samples) - 1, int(round(percent / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def format_summary(summary:dict) -> str:
+    lines = [f"{'stage':<24}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, stats in sorted(summary["stages"].items()):
+        lines.append(f"{name:<24}{stats['count']:>8}{stats['total']:>10.2f}{stats['mean'] * 1000:>10.1f}"
+                     f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}"
+                     f"{stats['max'] * 1000:>10.1f}")
+    if summary["counters"]:
+        lines.append(f"{'counter':<24}{'value':>8}")
+    for name, value in sorted(summary["counters"].items()):
+        lines.append(f"{name:<24}{value:>8}")
+    return "\n".join(lines)
+
+
+def enable(trace_file:str="trace.jsonl") -> Tracer:
+    """
+    Turns tracing on for the rest of the run, the summary gets printed when the program exits.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(trace_file)
+        atexit.register(disable)
+        logger.info(f"Tracing to {trace_file}")
+    return _tracer
+
+
+def disable() -> None:
+    global _tracer
+    if _tracer is not None:
+        tracer, _tracer = _tracer, None
+        tracer.close()
+
+
+def active() -> Tracer:
+    """
+    The tracer, or None when tracing is off. Hot loops fetch it once and check it instead of calling span().
+    """
+    return _tracer
+
+
+def span(name:str, **fields):
+    if _tracer is None:
+        return NO_SPAN
+    return Span(_tracer, name, fields)
+
+
+def count(name:str, value:int=1) -> None:
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+def observe(name:str, seconds:float) -> None:
+    if _tracer is not None:
+        _tracer.observe(name, seconds)
+
+
+def traced(name:str):
+    """
+    Decorator version of span().
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with Span(_tracer, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def counted(function, name:str):
+    """
+    Wraps a callable so every call bumps a counter, e.g. a driver's execute for WebDriver round trips.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        count(name)
+        return function(*args, **kwargs)
+    return wrapper
+
+
+# Only the main process, worker processes inherit the variable and would each append their own run to the file
+if os.environ.get("APP_TRACE") and multiprocessing.parent_process() is None:
+    enable("trace.jsonl" if os.environ["APP_TRACE"] == "1" else os.environ["APP_TRACE"])